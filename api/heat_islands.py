@@ -1,7 +1,13 @@
 import logging
-import json
+import math
+from collections import defaultdict
 from pathlib import Path
+import numpy as np
+import orjson
 from flask import Blueprint, jsonify, request
+from scipy.spatial import cKDTree
+from utils.gis_utils import calculate_distance
+from utils.http_utils import conditional_json, ojsonify
 
 # Create Blueprint
 heat_islands_bp = Blueprint('heat_islands', __name__)
@@ -14,7 +20,80 @@ BASE_DIR = Path(__file__).resolve().parent.parent.parent
 DATA_DIR = BASE_DIR / "data" / "processed"
 HEAT_ISLANDS_PATH = DATA_DIR / "heat_islands.json"
 
+# Approximate km per degree of latitude / of longitude at the equator
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.320
+
+# Parsed heat island data, reloaded only when the file's mtime changes
+_cache = {'mtime': None, 'data': None, 'summary': None, 'by_sev': None, 'near': None}
+
+def _build_summary(data):
+    """
+    Map the process_pipeline.py output ('total_count', 'mean_temperature',
+    'severity_distribution', 'heat_islands') to the summary format.
+    Returns None for the old list format.
+    """
+    if not (isinstance(data, dict) and 'heat_islands' in data):
+        return None
+        
+    summary = {
+        "total_islands": data.get('total_count', 0),
+        "severity_distribution": data.get('severity_distribution', {}),
+        "mean_temperature": data.get('mean_temperature', 0),
+        # Average intensity needs to be calculated from islands if not in summary
+        "average_intensity": 0
+    }
+    
+    islands = data['heat_islands']
+    if islands:
+        avg_int = sum(i['intensity'] for i in islands) / len(islands)
+        summary['average_intensity'] = round(avg_int, 2)
+        
+    return summary
+
+def _build_spatial_index(islands):
+    """
+    Build a KD-tree over island centroids for radius queries.
+    
+    Centroids are projected to a local equirectangular plane in km (scaled at
+    the mean latitude), so tree distances approximate ground distance.
+    Returns (tree, islands, lon_scale) or None if no island has coordinates.
+    """
+    located = [i for i in islands if i.get('lat') is not None and i.get('lon') is not None]
+    if not located:
+        return None
+        
+    lats = np.array([i['lat'] for i in located], dtype=float)
+    lons = np.array([i['lon'] for i in located], dtype=float)
+    lon_scale = KM_PER_DEG_LON * math.cos(math.radians(lats.mean()))
+    coords = np.column_stack((lons * lon_scale, lats * KM_PER_DEG_LAT))
+    
+    return cKDTree(coords), located, lon_scale
+
+def _load():
+    """
+    Return the cached heat island data, re-parsing the file only if it changed.
+    The summary and severity groupings are precomputed once per reload.
+    """
+    mtime = HEAT_ISLANDS_PATH.stat().st_mtime
+    if _cache['mtime'] == mtime:
+        return _cache
+        
+    data = orjson.loads(HEAT_ISLANDS_PATH.read_bytes())
+    
+    # If 'heat_islands' key exists (new format), use it, otherwise assume list (old format)
+    islands = data.get('heat_islands', []) if isinstance(data, dict) else data
+    
+    by_sev = defaultdict(list)
+    for island in islands:
+        by_sev[island.get('severity')].append(island)
+        
+    _cache.update(mtime=mtime, data=data, summary=_build_summary(data), by_sev=by_sev,
+                  near=_build_spatial_index(islands))
+    return _cache
+
 @heat_islands_bp.route('/heat-islands/all', methods=['GET'])
+@conditional_json(lambda: HEAT_ISLANDS_PATH)
 def get_heat_islands():
     """
     Return all detected heat islands.
@@ -23,15 +102,13 @@ def get_heat_islands():
         if not HEAT_ISLANDS_PATH.exists():
             return jsonify({'error': 'Heat island data not found'}), 404
             
-        with open(HEAT_ISLANDS_PATH, 'r') as f:
-            data = json.load(f)
-            
-        return jsonify(data)
+        return ojsonify(_load()['data'])
     except Exception as e:
         logger.error(f"Error in get_heat_islands: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @heat_islands_bp.route('/heat-islands/summary', methods=['GET'])
+@conditional_json(lambda: HEAT_ISLANDS_PATH)
 def get_heat_islands_summary():
     """
     Return heat island summary statistics.
@@ -40,57 +117,19 @@ def get_heat_islands_summary():
         if not HEAT_ISLANDS_PATH.exists():
             return jsonify({'error': 'Heat island data not found'}), 404
             
-        with open(HEAT_ISLANDS_PATH, 'r') as f:
-            data = json.load(f)
-            
-        # If 'heat_islands' key exists (new format), use it, otherwise assume list (old format)
-        islands_list = data.get('heat_islands', []) if isinstance(data, dict) else data
-        
-        # NOTE: If the data processing pipeline script outputs a dict with summary, we can just return that.
-        # But if we need to calculate derived stats or the structure differs, we do it here.
-        # The provided process_pipeline.py output structure is:
-        # {
-        #   'total_count': ...,
-        #   'mean_temperature': ...,
-        #   'threshold_used': ...,
-        #   'severity_distribution': ...,
-        #   'heat_islands': [...]
-        # }
-        # The user requester asks for:
-        # {
-        #    "total_islands": 8,
-        #    "severity_distribution": {...},
-        #    "average_intensity": 4.2,
-        #    "mean_temperature": 26.8
-        # }
-        
-        # Let's map existing data to requested format
-        if isinstance(data, dict) and 'heat_islands' in data:
-            # New format
-            summary = {
-                "total_islands": data.get('total_count', 0),
-                "severity_distribution": data.get('severity_distribution', {}),
-                "mean_temperature": data.get('mean_temperature', 0),
-                # Average intensity needs to be calculated from islands if not in summary
-                "average_intensity": 0
-            }
-            
-            islands = data['heat_islands']
-            if islands:
-                avg_int = sum(i['intensity'] for i in islands) / len(islands)
-                summary['average_intensity'] = round(avg_int, 2)
-                
-            return jsonify(summary)
-            
-        else:
+        summary = _load()['summary']
+        if summary is None:
             # Fallback for old list format if applicable
             return jsonify({'error': 'Unexpected data format'}), 500
+            
+        return ojsonify(summary)
 
     except Exception as e:
         logger.error(f"Error in get_heat_islands_summary: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @heat_islands_bp.route('/heat-islands/by-severity', methods=['GET'])
+@conditional_json(lambda: HEAT_ISLANDS_PATH, query_keys=('severity',))
 def get_heat_islands_by_severity():
     """
     Filter heat islands by severity level.
@@ -104,15 +143,54 @@ def get_heat_islands_by_severity():
         if not HEAT_ISLANDS_PATH.exists():
             return jsonify({'error': 'Heat island data not found'}), 404
             
-        with open(HEAT_ISLANDS_PATH, 'r') as f:
-            data = json.load(f)
+        return ojsonify(_load()['by_sev'].get(severity, []))
+        
+    except Exception as e:
+        logger.error(f"Error in get_heat_islands_by_severity: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@heat_islands_bp.route('/heat-islands/near', methods=['GET'])
+@conditional_json(lambda: HEAT_ISLANDS_PATH, query_keys=('lat', 'lon', 'radius_km'))
+def get_heat_islands_near():
+    """
+    Return heat islands within a radius of a point, nearest first.
+    Query params: lat, lon, radius_km (default 5)
+    """
+    try:
+        if 'lat' not in request.args or 'lon' not in request.args:
+            return jsonify({'error': 'Missing lat/lon parameters'}), 400
+            
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        radius_km = float(request.args.get('radius_km', 5))
+        if radius_km <= 0:
+            return jsonify({'error': 'radius_km must be positive'}), 400
+            
+        if not HEAT_ISLANDS_PATH.exists():
+            return jsonify({'error': 'Heat island data not found'}), 404
+            
+        near = _load()['near']
+        if near is None:
+            return ojsonify([])
             
-        islands = data.get('heat_islands', []) if isinstance(data, dict) else data
+        tree, islands, lon_scale = near
         
-        filtered = [i for i in islands if i.get('severity') == severity]
+        # The planar projection is approximate: over-fetch slightly, then filter by haversine
+        candidates = tree.query_ball_point([lon * lon_scale, lat * KM_PER_DEG_LAT], radius_km * 1.1)
         
-        return jsonify(filtered)
+        results = []
+        for idx in candidates:
+            island = islands[idx]
+            distance = calculate_distance((lat, lon), (island['lat'], island['lon']))
+            if distance <= radius_km:
+                results.append({**island, 'distance_km': round(distance, 3)})
+                
+        results.sort(key=lambda x: x['distance_km'])
         
+        return ojsonify(results)
+        
+    except ValueError:
+        return jsonify({'error': 'Invalid coordinate format'}), 400
     except Exception as e:
-        logger.error(f"Error in get_heat_islands_by_severity: {e}")
+        logger.error(f"Error in get_heat_islands_near: {e}")
         return jsonify({'error': 'Internal server error'}), 500
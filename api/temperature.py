@@ -2,8 +2,9 @@ import logging
 import json
 from pathlib import Path
 import numpy as np
-import rasterio
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
+from utils.gis_utils import HEATMAP_RESOLUTIONS, build_heatmap, load_raster, preload_raster
+from utils.http_utils import conditional_json
 
 # Create Blueprint
 temperature_bp = Blueprint('temperature', __name__)
@@ -17,6 +18,9 @@ DATA_DIR = BASE_DIR / "data" / "processed"
 TEMP_RASTER_PATH = DATA_DIR / "temperature_la.tif"
 TEMP_STATS_PATH = DATA_DIR / "temperature_la_stats.json"
 
+# Read once in the gunicorn master when preloading
+preload_raster(TEMP_RASTER_PATH)
+
 @temperature_bp.route('/temperature/point', methods=['POST'])
 def get_temperature_point():
     """
@@ -39,35 +43,25 @@ def get_temperature_point():
         if not TEMP_RASTER_PATH.exists():
             return jsonify({'error': 'Temperature data not found'}), 404
             
-        with rasterio.open(TEMP_RASTER_PATH) as src:
-            # Check bounds
-            if (lon < src.bounds.left or lon > src.bounds.right or 
-                lat < src.bounds.bottom or lat > src.bounds.top):
-                return jsonify({'error': 'Coordinates out of bounds'}), 400
-                
-            # Get pixel coordinates
-            row, col = src.index(lon, lat)
-            
-            # Read value (Window(col, row, 1, 1))
-            # Read integer/float data
-            window = rasterio.windows.Window(col, row, 1, 1)
-            val = src.read(1, window=window)
-            
-            temp_value = float(val[0][0])
+        raster = load_raster(TEMP_RASTER_PATH)
+        # Check bounds
+        if not raster.contains(lat, lon):
+            return jsonify({'error': 'Coordinates out of bounds'}), 400
             
-            # Check nodata
-            if src.nodata is not None and temp_value == src.nodata:
-                return jsonify({'error': 'No data at this location'}), 404
-                
-            if np.isnan(temp_value):
-                 return jsonify({'error': 'No data at this location (NaN)'}), 404
+        # Get pixel coordinates and read the value from the in-memory band
+        row, col = raster.index(lat, lon)
+        temp_value = float(raster.array[row, col])
+        
+        # Check nodata (NaN in the loaded band)
+        if np.isnan(temp_value):
+            return jsonify({'error': 'No data at this location'}), 404
 
-            return jsonify({
-                'temperature': round(temp_value, 2),
-                'lat': lat,
-                'lon': lon,
-                'unit': 'celsius'
-            })
+        return jsonify({
+            'temperature': round(temp_value, 2),
+            'lat': lat,
+            'lon': lon,
+            'unit': 'celsius'
+        })
             
     except ValueError as e:
         return jsonify({'error': f'Invalid coordinate format: {e}'}), 400
@@ -76,6 +70,7 @@ def get_temperature_point():
         return jsonify({'error': 'Internal server error'}), 500
 
 @temperature_bp.route('/temperature/statistics', methods=['GET'])
+@conditional_json(lambda: TEMP_STATS_PATH)
 def get_temperature_statistics():
     """
     Return overall temperature statistics.
@@ -97,6 +92,7 @@ def get_temperature_statistics():
         return jsonify({'error': 'Internal server error'}), 500
 
 @temperature_bp.route('/temperature/heatmap', methods=['GET'])
+@conditional_json(lambda: TEMP_RASTER_PATH, query_keys=('resolution',))
 def get_temperature_heatmap():
     """
     Return downsampled temperature data for heatmap visualization.
@@ -115,57 +111,15 @@ def get_temperature_heatmap():
     try:
         resolution = request.args.get('resolution', 'medium')
         
-        # Define resolutions
-        resolutions = {
-            'low': (100, 100),
-            'medium': (200, 200),
-            'high': (500, 500)
-        }
-        
-        if resolution not in resolutions:
-            return jsonify({'error': f'Invalid resolution. Must be one of {list(resolutions.keys())}'}), 400
+        if resolution not in HEATMAP_RESOLUTIONS:
+            return jsonify({'error': f'Invalid resolution. Must be one of {list(HEATMAP_RESOLUTIONS.keys())}'}), 400
             
-        out_shape = resolutions[resolution]
-        
         if not TEMP_RASTER_PATH.exists():
             return jsonify({'error': 'Temperature data not found'}), 404
             
-        with rasterio.open(TEMP_RASTER_PATH) as src:
-            # Read and resample
-            data = src.read(
-                1,
-                out_shape=out_shape,
-                resampling=rasterio.enums.Resampling.bilinear
-            )
-            
-            # bounds
-            bounds = {
-                "west": src.bounds.left,
-                "south": src.bounds.bottom,
-                "east": src.bounds.right,
-                "north": src.bounds.top
-            }
-            
-            # Handle NoData/NaN
-            # Convert to list with None for nulls
-            data_float = data.astype(float)
-            if src.nodata is not None:
-                data_float[data == src.nodata] = np.nan
-                
-            # Convert NaN to None for JSON
-            # numpy array to list, replacing nan with None requires logic
-            # Easiest way: where(isnan, None, val) but numpy doesn't hold None well in float array
-            # Iterate or pandas conversion
-            
-            # Optimized approach:
-            data_list = np.where(np.isnan(data_float), None, data_float).tolist()
-            
-            return jsonify({
-                "data": data_list,
-                "bounds": bounds,
-                "resolution": list(out_shape),
-                "unit": "celsius"
-            })
+        mtime = TEMP_RASTER_PATH.stat().st_mtime
+        body = build_heatmap(str(TEMP_RASTER_PATH), mtime, resolution, 'celsius')
+        return Response(body, mimetype='application/json')
             
     except Exception as e:
         logger.error(f"Error in get_temperature_heatmap: {e}")
@@ -2,8 +2,9 @@ import logging
 import json
 from pathlib import Path
 import numpy as np
-import rasterio
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
+from utils.gis_utils import HEATMAP_RESOLUTIONS, build_heatmap, latlon_to_pixel_batch, load_raster, preload_raster
+from utils.http_utils import conditional_json, ojsonify
 
 # Create Blueprint
 vegetation_bp = Blueprint('vegetation', __name__)
@@ -18,6 +19,34 @@ NDVI_RASTER_PATH = DATA_DIR / "ndvi_la.tif"
 NDVI_STATS_PATH = DATA_DIR / "ndvi_la_stats.json"
 VEGETATION_ANALYSIS_PATH = DATA_DIR / "vegetation_analysis.json"
 
+# NDVI class boundaries; class i covers [NDVI_THRESHOLDS[i-1], NDVI_THRESHOLDS[i])
+NDVI_THRESHOLDS = (0.2, 0.5, 0.7)
+VEGETATION_LEVELS = ('bare_soil_urban', 'sparse_vegetation', 'moderate_vegetation', 'dense_vegetation')
+VEGETATION_HEALTH = ('none', 'fair', 'good', 'excellent')
+
+# Thresholds as float32, the dtype of the raster values. Both point endpoints
+# classify with _classify(), so a pixel gets the same class from either; an
+# NDVI of exactly 0.7 (float32 0.699999988) is dense, not just below 0.7
+_THRESHOLDS_F32 = np.array(NDVI_THRESHOLDS, dtype=np.float32)
+_LEVELS_ARR = np.array(VEGETATION_LEVELS)
+_HEALTH_ARR = np.array(VEGETATION_HEALTH)
+
+def _classify(values) -> np.ndarray:
+    """
+    Class index (into VEGETATION_LEVELS / VEGETATION_HEALTH) of float32 NDVI values.
+    
+    side='right' puts a value equal to a threshold in the class above it,
+    i.e. class i covers [NDVI_THRESHOLDS[i-1], NDVI_THRESHOLDS[i]).
+    NaN sorts past the last threshold; callers mask it themselves.
+    """
+    return np.searchsorted(_THRESHOLDS_F32, np.asarray(values, dtype=np.float32), side='right')
+
+# Upper bound on coordinates per batch request
+MAX_BATCH_POINTS = 10000
+
+# Read once in the gunicorn master when preloading
+preload_raster(NDVI_RASTER_PATH)
+
 @vegetation_bp.route('/vegetation/point', methods=['POST'])
 def get_vegetation_point():
     """
@@ -40,43 +69,30 @@ def get_vegetation_point():
         if not NDVI_RASTER_PATH.exists():
             return jsonify({'error': 'NDVI data not found'}), 404
             
-        with rasterio.open(NDVI_RASTER_PATH) as src:
-            if (lon < src.bounds.left or lon > src.bounds.right or 
-                lat < src.bounds.bottom or lat > src.bounds.top):
-                return jsonify({'error': 'Coordinates out of bounds'}), 400
-                
-            row, col = src.index(lon, lat)
-            window = rasterio.windows.Window(col, row, 1, 1)
-            val = src.read(1, window=window)
-            ndvi_value = float(val[0][0])
+        raster = load_raster(NDVI_RASTER_PATH)
+        if not raster.contains(lat, lon):
+            return jsonify({'error': 'Coordinates out of bounds'}), 400
             
-            if src.nodata is not None and ndvi_value == src.nodata:
-                return jsonify({'error': 'No data at this location'}), 404
-                
-            if np.isnan(ndvi_value):
-                 return jsonify({'error': 'No data at this location (NaN)'}), 404
+        row, col = raster.index(lat, lon)
+        pixel = raster.array[row, col]
+        ndvi_value = float(pixel)
+        
+        # NoData is NaN in the loaded band
+        if np.isnan(ndvi_value):
+            return jsonify({'error': 'No data at this location'}), 404
 
-            # Classification
-            if ndvi_value < 0.2:
-                level = "bare_soil_urban"
-                health = "none"
-            elif ndvi_value < 0.5:
-                level = "sparse_vegetation"
-                health = "fair"
-            elif ndvi_value < 0.7:
-                level = "moderate_vegetation"
-                health = "good"
-            else:
-                level = "dense_vegetation"
-                health = "excellent"
+        # Classification
+        cls = int(_classify(pixel))
+        level = VEGETATION_LEVELS[cls]
+        health = VEGETATION_HEALTH[cls]
 
-            return jsonify({
-                'ndvi': round(ndvi_value, 3),
-                'vegetation_level': level,
-                'health': health,
-                'lat': lat,
-                'lon': lon
-            })
+        return jsonify({
+            'ndvi': round(ndvi_value, 3),
+            'vegetation_level': level,
+            'health': health,
+            'lat': lat,
+            'lon': lon
+        })
             
     except ValueError:
         return jsonify({'error': 'Invalid coordinate format'}), 400
@@ -84,7 +100,77 @@ def get_vegetation_point():
         logger.error(f"Error in get_vegetation_point: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@vegetation_bp.route('/vegetation/points', methods=['POST'])
+def get_vegetation_points():
+    """
+    Get NDVI values and classes for a batch of coordinates in one request.
+    
+    Input:
+        [{"lat": float, "lon": float}, ...]
+        
+    Returns:
+        [{"ndvi": float, "vegetation_level": str, "health": str, "lat": float, "lon": float}, ...]
+        in input order; ndvi/vegetation_level/health are null for points
+        outside the raster or without data.
+    """
+    try:
+        points = request.get_json()
+        if not isinstance(points, list) or not points:
+            return jsonify({'error': 'Request body must be a non-empty list of {lat, lon}'}), 400
+        if len(points) > MAX_BATCH_POINTS:
+            return jsonify({'error': f'At most {MAX_BATCH_POINTS} points per request'}), 400
+            
+        lats = np.array([float(p['lat']) for p in points])
+        lons = np.array([float(p['lon']) for p in points])
+        
+        if not NDVI_RASTER_PATH.exists():
+            return jsonify({'error': 'NDVI data not found'}), 404
+            
+        raster = load_raster(NDVI_RASTER_PATH)
+        bounds = raster.bounds
+        inside = ((lons >= bounds.left) & (lons <= bounds.right) &
+                  (lats >= bounds.bottom) & (lats <= bounds.top))
+        
+        # Inverse affine for all in-bounds points at once
+        height, width = raster.array.shape
+        rows, cols = latlon_to_pixel_batch(lats[inside], lons[inside], raster.transform)
+        rows = np.minimum(rows, height - 1)
+        cols = np.minimum(cols, width - 1)
+        
+        values = np.full(lats.shape, np.nan, dtype=np.float32)
+        values[inside] = raster.array[rows, cols]
+        valid = ~np.isnan(values)
+        
+        # Branchless classification: one vectorized binary search per value,
+        # the same rule as the point endpoint. NaN is masked below.
+        classes = _classify(values)
+        levels = _LEVELS_ARR[classes].tolist()
+        health = _HEALTH_ARR[classes].tolist()
+        
+        results = [
+            {
+                'ndvi': ndvi if ok else None,
+                'vegetation_level': level if ok else None,
+                'health': h if ok else None,
+                'lat': lat,
+                'lon': lon
+            }
+            for ndvi, level, h, ok, lat, lon in zip(
+                np.round(values.astype(np.float64), 3).tolist(), levels, health,
+                valid.tolist(), lats.tolist(), lons.tolist()
+            )
+        ]
+        
+        return ojsonify(results)
+            
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid coordinate format'}), 400
+    except Exception as e:
+        logger.error(f"Error in get_vegetation_points: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @vegetation_bp.route('/vegetation/statistics', methods=['GET'])
+@conditional_json(lambda: NDVI_STATS_PATH)
 def get_vegetation_statistics():
     """Return overall vegetation statistics."""
     try:
@@ -100,6 +186,7 @@ def get_vegetation_statistics():
         return jsonify({'error': 'Internal server error'}), 500
 
 @vegetation_bp.route('/vegetation/analysis', methods=['GET'])
+@conditional_json(lambda: VEGETATION_ANALYSIS_PATH)
 def get_vegetation_analysis():
     """Return full vegetation analysis."""
     try:
@@ -115,42 +202,23 @@ def get_vegetation_analysis():
         return jsonify({'error': 'Internal server error'}), 500
 
 @vegetation_bp.route('/vegetation/heatmap', methods=['GET'])
+@conditional_json(lambda: NDVI_RASTER_PATH, query_keys=('resolution',))
 def get_vegetation_heatmap():
     """
     Return downsampled NDVI data for heatmap.
     """
     try:
         resolution = request.args.get('resolution', 'medium')
-        resolutions = {'low': (100, 100), 'medium': (200, 200), 'high': (500, 500)}
         
-        if resolution not in resolutions:
+        if resolution not in HEATMAP_RESOLUTIONS:
             return jsonify({'error': 'Invalid resolution'}), 400
             
-        out_shape = resolutions[resolution]
-        
         if not NDVI_RASTER_PATH.exists():
             return jsonify({'error': 'NDVI data not found'}), 404
             
-        with rasterio.open(NDVI_RASTER_PATH) as src:
-            data = src.read(1, out_shape=out_shape, resampling=rasterio.enums.Resampling.bilinear)
-            
-            data_float = data.astype(float)
-            if src.nodata is not None:
-                data_float[data == src.nodata] = np.nan
-                
-            data_list = np.where(np.isnan(data_float), None, data_float).tolist()
-            
-            bounds = {
-                "west": src.bounds.left, "south": src.bounds.bottom,
-                "east": src.bounds.right, "north": src.bounds.top
-            }
-            
-            return jsonify({
-                "data": data_list,
-                "bounds": bounds,
-                "resolution": list(out_shape),
-                "unit": "NDVI"
-            })
+        mtime = NDVI_RASTER_PATH.stat().st_mtime
+        body = build_heatmap(str(NDVI_RASTER_PATH), mtime, resolution, 'NDVI')
+        return Response(body, mimetype='application/json')
             
     except Exception as e:
         logger.error(f"Error in get_vegetation_heatmap: {e}")
@@ -44,15 +44,11 @@ def create_app():
     @app.route('/api/health', methods=['GET'])
     def health_check():
         """Health check with route listing."""
-        routes = []
-        for rule in app.url_map.iter_rules():
-            routes.append(str(rule))
-            
         return jsonify({
             'status': 'healthy',
             'service': 'Urban Heat Island Mapper API',
             'version': '1.0.0',
-            'routes': sorted(routes)
+            'routes': app.config['SORTED_ROUTES']
         })
     
     @app.route('/api/info', methods=['GET'])
@@ -65,7 +61,8 @@ def create_app():
             "temperature_raster": (data_dir / "temperature_la.tif").exists(),
             "ndvi_raster": (data_dir / "ndvi_la.tif").exists(),
             "heat_islands_json": (data_dir / "heat_islands.json").exists(),
-            "vegetation_analysis_json": (data_dir / "vegetation_analysis.json").exists()
+            "vegetation_analysis_json": (data_dir / "vegetation_analysis.json").exists(),
+            "green_space_recommendations_json": (data_dir / "green_space_recommendations.json").exists()
         }
         
         return jsonify({
@@ -92,12 +89,16 @@ def create_app():
     def internal_error(error):
         logger.error(f"Server Error: {error}")
         return jsonify({'error': 'Internal server error'}), 500
+    
+    # Route table is fixed once everything is registered
+    app.config['SORTED_ROUTES'] = sorted(str(rule) for rule in app.url_map.iter_rules())
         
     return app
 
 app = create_app()
 
 if __name__ == '__main__':
+    # Development server only; production runs gunicorn -c gunicorn.conf.py app:app
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('FLASK_DEBUG') == 'True'
     
@@ -5,8 +5,11 @@ import rasterio
 import geopandas as gpd
 import numpy as np
 import pandas as pd
-from rasterio.features import geometry_mask
+import pyogrio
+from rasterio.features import rasterize, shapes as raster_shapes
+from scipy.ndimage import uniform_filter
 from shapely.geometry import shape
+from backend.utils.gis_utils import read_band
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,47 +23,66 @@ class VegetationAnalyzer:
         self.ndvi_path = ndvi_path
         self.parks_path = parks_geojson_path
         
+    def _read_ndvi(self):
+        """Read the NDVI band in NDVI units (NoData as NaN) with its transform and CRS."""
+        with rasterio.open(self.ndvi_path) as src:
+            return read_band(src), src.transform, src.crs
+        
     def calculate_park_coverage(self) -> Dict:
         """
         Calculate NDVI statistics for each park.
         """
         try:
             logger.info("Loading parks data...")
-            parks = gpd.read_file(self.parks_path)
+            # pyogrio reads all features in one C call; only deserialize the attributes we use
+            fields = pyogrio.read_info(self.parks_path)['fields']
+            columns = [c for c in ('osm_id',) if c in fields]
+            parks = gpd.read_file(self.parks_path, engine='pyogrio', columns=columns)
             
             summary = {
                 "total_parks": len(parks),
                 "parks_analysis": []
             }
             
-            with rasterio.open(self.ndvi_path) as src:
-                ndvi = src.read(1)
-                transform = src.transform
-                
-                # Check CRs match implies re-projection if needed.
-                # Assuming data pipeline aligned CRS (e.g. EPSG:4326 to match or UTM)
-                # For this script we assume input is compatible.
+            ndvi, transform, _ = self._read_ndvi()
                 
-                for idx, row in parks.iterrows():
-                    geom = row.geometry
-                    
-                    # Create mask for this geometry
-                    mask = geometry_mask([geom], transform=transform, invert=True, out_shape=ndvi.shape)
-                    
-                    park_pixels = ndvi[mask]
-                    valid_pixels = park_pixels[park_pixels > -1] # Filter NoData
-                    
-                    if valid_pixels.size == 0:
-                        continue
-                        
-                    mean_ndvi = float(np.mean(valid_pixels))
-                    
-                    summary["parks_analysis"].append({
-                        "id": idx,  # or row.get('id')
-                        "osm_id": row.get('osm_id', 'unknown'),
-                        "mean_ndvi": mean_ndvi,
-                        "health": "healthy" if mean_ndvi > 0.4 else "poor"
-                    })
+            # Check CRs match implies re-projection if needed.
+            # Assuming data pipeline aligned CRS (e.g. EPSG:4326 to match or UTM)
+            # For this script we assume input is compatible.
+            
+            # Burn every park into one label raster (park i -> label i+1, 0 = outside).
+            # Where parks overlap, the later park owns the shared pixels.
+            shapes = (
+                (geom, i + 1) for i, geom in enumerate(parks.geometry.values)
+                if geom is not None and not geom.is_empty
+            )
+            labels = rasterize(shapes, out_shape=ndvi.shape, transform=transform, fill=0, dtype='int32')
+            labels[~(ndvi > -1)] = 0 # Filter NoData (and NaN)
+            
+            # Per-park valid pixel counts and NDVI sums in one pass each
+            n_labels = len(parks) + 1
+            counts = np.bincount(labels.ravel(), minlength=n_labels)[1:]
+            sums = np.bincount(labels.ravel(), weights=ndvi.ravel(), minlength=n_labels)[1:]
+            
+            has_pixels = counts > 0
+            means = np.zeros(len(parks))
+            np.divide(sums, counts, out=means, where=has_pixels)
+            healthy = means > 0.4
+            
+            # Plain column lists instead of per-row pandas objects
+            park_ids = parks.index.tolist()
+            has_osm = 'osm_id' in parks.columns
+            osm_ids = parks['osm_id'].tolist() if has_osm else None
+            mean_list = means.tolist()
+            healthy_list = healthy.tolist()
+            
+            for idx in np.flatnonzero(has_pixels).tolist():
+                summary["parks_analysis"].append({
+                    "id": park_ids[idx],  # or the park's own id column
+                    "osm_id": osm_ids[idx] if has_osm else 'unknown',
+                    "mean_ndvi": mean_list[idx],
+                    "health": "healthy" if healthy_list[idx] else "poor"
+                })
                     
             return summary
             
@@ -68,15 +90,35 @@ class VegetationAnalyzer:
             logger.error(f"Error analyzing parks: {e}")
             return {}
 
-    def find_vegetation_gaps(self, threshold: float = 0.3) -> gpd.GeoDataFrame:
+    def find_vegetation_gaps(self, threshold: float = 0.3, size: int = 9) -> gpd.GeoDataFrame:
         """
         Identify areas with low vegetation (potential planting sites).
-        This is complex on raster; we might return just statistics for now 
-        or use simple thresholding if needed.
+        
+        A pixel is a gap when the mean NDVI of the size x size window around
+        it is below threshold; connected gap pixels are returned as polygons.
         """
-        # Placeholder for full vectorization logic
-        logger.info("Vegetation gap analysis not fully implemented in this lightweight script.")
-        return gpd.GeoDataFrame()
+        try:
+            ndvi, transform, crs = self._read_ndvi()
+            
+            # Windowed mean over valid pixels only: box-filter the NaN-zeroed
+            # values and the valid mask, then divide (separable, O(1) per pixel)
+            valid = ~np.isnan(ndvi)
+            filled = np.where(valid, ndvi, np.float32(0))
+            window_sum = uniform_filter(filled, size=size, mode='nearest')
+            window_valid = uniform_filter(valid.astype(np.float32), size=size, mode='nearest')
+            
+            gaps = valid & (window_sum < threshold * window_valid)
+            
+            geoms = [
+                shape(geom) for geom, _ in
+                raster_shapes(gaps.astype(np.uint8), mask=gaps, transform=transform)
+            ]
+            logger.info(f"Found {len(geoms)} vegetation gap polygons.")
+            return gpd.GeoDataFrame(geometry=geoms, crs=crs)
+            
+        except Exception as e:
+            logger.error(f"Error finding vegetation gaps: {e}")
+            return gpd.GeoDataFrame()
 
 if __name__ == "__main__":
     print("Vegetation Analyzer Initialized")
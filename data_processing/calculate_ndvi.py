@@ -1,7 +1,54 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import rasterio
 import numpy as np
+from numba import njit
 from pathlib import Path
 import json
+from rasterio.shutil import copy as rio_copy
+from backend.utils.gis_utils import GDAL_ENV, INT16_NODATA
+
+# Sentinel-2 L2A: values are 0-10000 (reflectance * 10000)
+REFLECTANCE_SCALE = 1.0 / 10000.0
+
+# Output is int16 NDVI * 10000 (4 decimals); readers apply the band scale
+NDVI_SCALE = 0.0001
+
+@njit(nogil=True, fastmath=True, cache=True)
+def _ndvi_kernel(red, nir, out, scaled):
+    """
+    Fused NDVI: scale, ratio and clip per pixel in one pass over the
+    integer DN bands, writing float32 into out and int16 (NDVI / NDVI_SCALE)
+    into scaled.
+    Serial and GIL-free: blocks are processed in parallel by a thread pool.
+    
+    Returns:
+        (min, max, sum, count, count > 0.3) over valid pixels (-1 < NDVI < 1).
+    """
+    mn = np.inf
+    mx = -np.inf
+    s = 0.0
+    n_valid = 0
+    n_vegetated = 0
+    for i in range(red.shape[0]):
+        for j in range(red.shape[1]):
+            r = red[i, j] * REFLECTANCE_SCALE
+            n = nir[i, j] * REFLECTANCE_SCALE
+            d = n + r
+            v = 0.0 if d == 0 else (n - r) / d
+            v = -1.0 if v < -1 else (1.0 if v > 1 else v)
+            out[i, j] = v
+            scaled[i, j] = np.int16(round(v * 10000.0))
+            if -1.0 < v < 1.0:
+                mn = min(mn, v)
+                mx = max(mx, v)
+                s += v
+                n_valid += 1
+                if v > 0.3:
+                    n_vegetated += 1
+    return mn, mx, s, n_valid, n_vegetated
 
 class SentinelNDVIProcessor:
     """Calculate NDVI from Sentinel-2 data"""
@@ -9,9 +56,13 @@ class SentinelNDVIProcessor:
     def __init__(self, sentinel_dir):
         self.sentinel_dir = Path(sentinel_dir)
     
-    def calculate_ndvi(self, output_path):
+    def calculate_ndvi(self, output_path, return_array=True):
         """
         Calculate NDVI from Sentinel-2 Red (B04) and NIR (B08)
+        
+        Blocks are written to a tiled GTiff on disk and converted to COG at the
+        end. With return_array=False no full-scene array is built in memory
+        and None is returned in its place.
         """
         
         # Find band files
@@ -30,42 +81,144 @@ class SentinelNDVIProcessor:
         print(f'  Red: {red_file.name}')
         print(f'  NIR: {nir_file.name}')
         
-        # Read Red band
-        with rasterio.open(red_file) as red_src:
-            red = red_src.read(1).astype(float)
-            profile = red_src.profile.copy()
+        # Ensure dir exists
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        
+        # Stream both bands block by block; blocks are independent, so worker
+        # threads read and compute them in parallel while this thread writes
+        with rasterio.Env(**GDAL_ENV), rasterio.open(red_file) as red_src:
             height = red_src.height
             width = red_src.width
             crs = red_src.crs
             transform = red_src.transform
+            windows = [window for _, window in red_src.block_windows(1)]
+            
+            # Save
+            # FIX: Build the output profile from scratch (don't copy the JP2 profile):
+            # COG of scaled int16, tiled with overviews
+            profile = {
+                'driver': 'COG',
+                'height': height,
+                'width': width,
+                'count': 1,
+                'dtype': 'int16',
+                'crs': crs,
+                'transform': transform,
+                'nodata': INT16_NODATA,
+                'compress': 'DEFLATE',
+                'predictor': 2,
+                'blocksize': 512,
+                'overview_resampling': 'average',
+                'num_threads': 'ALL_CPUS'
+            }
+            
+        # The COG driver can only copy a finished dataset (opened for writing,
+        # rasterio would buffer the whole scene in memory), so blocks stream
+        # into a tiled GTiff that is converted once complete
+        tmp_path = str(Path(output_path).with_suffix('.tmp.tif'))
+        tmp_profile = {
+            'driver': 'GTiff',
+            'height': height,
+            'width': width,
+            'count': 1,
+            'dtype': 'int16',
+            'crs': crs,
+            'transform': transform,
+            'nodata': INT16_NODATA,
+            'tiled': True,
+            'blockxsize': 512,
+            'blockysize': 512,
+            'BIGTIFF': 'IF_SAFER'
+        }
         
-        # Read NIR band
-        with rasterio.open(nir_file) as nir_src:
-            nir = nir_src.read(1).astype(float)
-        
-        # Sentinel-2 L2A: values are 0-10000 (reflectance * 10000)
-        # Convert to 0-1 scale
-        red = red / 10000.0
-        nir = nir / 10000.0
-        
-        # Calculate NDVI
-        denominator = nir + red
-        ndvi = np.where(
-            denominator == 0,
-            0,
-            (nir - red) / denominator
-        )
-        
-        # Clip to valid range
-        ndvi = np.clip(ndvi, -1, 1)
+        # Full float32 result only when the caller wants it back
+        ndvi = np.empty((height, width), np.float32) if return_array else None
+        
+        # rasterio datasets are not safe to share between threads: one pair per worker
+        local = threading.local()
+        opened = []
+        
+        def process_block(window):
+            with rasterio.Env(**GDAL_ENV):
+                if not hasattr(local, 'srcs'):
+                    local.srcs = (rasterio.open(red_file), rasterio.open(nir_file))
+                    opened.extend(local.srcs)
+                red_src, nir_src = local.srcs
+                
+                # Native integer DNs, no float copy
+                red = red_src.read(1, window=window)
+                nir = nir_src.read(1, window=window)
+            
+            # Scaled to reflectance and clipped to [-1, 1] in the kernel
+            if ndvi is not None:
+                rows, cols = window.toslices()
+                tile = ndvi[rows, cols]
+            else:
+                tile = np.empty(red.shape, np.float32)
+            scaled = np.empty(red.shape, np.int16)
+            # Block statistics come out of the same pass, no masks or gathers
+            block_stats = _ndvi_kernel(red, nir, tile, scaled)
+            return window, scaled, block_stats
+        
+        n_workers = os.cpu_count()
+        
+        # Running statistics over valid pixels (-1 < NDVI < 1)
+        v_min, v_max = np.inf, -np.inf
+        v_sum = 0.0
+        v_count = 0
+        v_vegetated = 0
+        
+        try:
+            with rasterio.Env(**GDAL_ENV), \
+                 rasterio.open(tmp_path, 'w', **tmp_profile) as dst, \
+                 ThreadPoolExecutor(max_workers=n_workers) as executor:
+                dst.scales = (NDVI_SCALE,)
+                dst.offsets = (0.0,)
+                
+                # Bounded read-ahead: at most two blocks per worker are in flight,
+                # so finished blocks never pile up faster than they are written
+                pending = deque()
+                blocks = iter(windows)
+                for window in blocks:
+                    pending.append(executor.submit(process_block, window))
+                    if len(pending) >= 2 * n_workers:
+                        break
+                
+                while pending:
+                    window, scaled, block_stats = pending.popleft().result()
+                    next_window = next(blocks, None)
+                    if next_window is not None:
+                        pending.append(executor.submit(process_block, next_window))
+                    dst.write(scaled, 1, window=window)
+                    
+                    # Blocks without valid pixels report min=inf, max=-inf
+                    b_min, b_max, b_sum, b_count, b_vegetated = block_stats
+                    v_min = min(v_min, b_min)
+                    v_max = max(v_max, b_max)
+                    v_sum += b_sum
+                    v_count += b_count
+                    v_vegetated += b_vegetated
+            
+            if v_count == 0:
+                raise ValueError("No valid NDVI pixels")
+            
+            # Scale/offset and nodata are carried over by the copy
+            cog_options = {k: v for k, v in profile.items() if k in
+                           ('compress', 'predictor', 'blocksize', 'overview_resampling', 'num_threads')}
+            with rasterio.Env(**GDAL_ENV):
+                rio_copy(tmp_path, output_path, driver='COG', **cog_options)
+        finally:
+            for src in opened:
+                src.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
         
         # Statistics
-        valid_ndvi = ndvi[(ndvi > -1) & (ndvi < 1)]
         stats = {
-            'min': float(valid_ndvi.min()),
-            'max': float(valid_ndvi.max()),
-            'mean': float(valid_ndvi.mean()),
-            'vegetation_coverage': float((valid_ndvi > 0.3).sum() / valid_ndvi.size * 100)
+            'min': v_min,
+            'max': v_max,
+            'mean': v_sum / v_count,
+            'vegetation_coverage': v_vegetated / v_count * 100
         }
         
         print(f'NDVI Stats:')
@@ -74,31 +227,6 @@ class SentinelNDVIProcessor:
         print(f'  Mean: {stats["mean"]:.3f}')
         print(f'  Vegetation Coverage (NDVI>0.3): {stats["vegetation_coverage"]:.1f}%')
         
-        # Save
-        # FIX: Force driver to GTiff and format to float32
-        # Remove JP2 specific keys that cause driver errors
-        for key in ['driver', 'interleave', 'tiled', 'blockxsize', 'blockysize', 'compress']:
-            if key in profile:
-                del profile[key]
-
-        profile = {
-            'driver': 'GTiff',
-            'height': height,
-            'width': width,
-            'count': 1,
-            'dtype': 'float32',
-            'crs': crs,
-            'transform': transform,
-            'nodata': -9999,
-            'compress': 'lzw'
-        }
-        
-        # Ensure dir exists
-        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-        
-        with rasterio.open(output_path, 'w', **profile) as dst:
-            dst.write(ndvi.astype('float32'), 1)
-        
         # Save stats
         stats_path = output_path.replace('.tif', '_stats.json')
         with open(stats_path, 'w') as f:
@@ -1,14 +1,52 @@
 import logging
 import json
 from pathlib import Path
+import math
 from typing import Tuple, Dict
 import numpy as np
 import rasterio
+from numba import njit, prange
+from backend.utils.gis_utils import GDAL_ENV
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Collection 2 Level 2 ST scaling, folded with the Kelvin -> Celsius offset
+ST_SCALE = 0.00341802
+ST_OFFSET_CELSIUS = 149.0 - 273.15
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _lst(dn, out):
+    """
+    Fused LST: scale DN to Celsius, mask NoData (DN 0) and implausible
+    values (outside -50..70C) to -9999, and accumulate stats in one pass.
+    dn and out may be the same array (in-place conversion).
+    
+    Returns:
+        (min, max, sum, sum of squares, count) over valid pixels.
+    """
+    mn = np.inf
+    mx = -np.inf
+    s = 0.0
+    s2 = 0.0
+    n = 0
+    for i in prange(dn.shape[0]):
+        for j in range(dn.shape[1]):
+            d = dn[i, j]
+            if d > 0:
+                t = d * ST_SCALE + ST_OFFSET_CELSIUS
+                if -50 < t < 70:
+                    out[i, j] = t
+                    mn = min(mn, t)
+                    mx = max(mx, t)
+                    s += t
+                    s2 += t * t
+                    n += 1
+                    continue
+            out[i, j] = -9999.0
+    return mn, mx, s, s2, n
+
 class TemperatureProcessor:
     """
     Processor for Land Surface Temperature (LST) from Landsat data.
@@ -37,9 +75,11 @@ class TemperatureProcessor:
             input_file = band10_files[0]
             logger.info(f"Processing thermal band from {input_file}")
             
-            with rasterio.open(input_file) as src:
-                # Read data
-                dn = src.read(1).astype(np.float32)
+            with rasterio.Env(**GDAL_ENV), rasterio.open(input_file) as src:
+                # Read data straight into the float32 output buffer; the DNs are
+                # converted in place below, so no second full-size array is needed
+                final_temp = np.empty(src.shape, np.float32)
+                src.read(1, out=final_temp, out_dtype='float32')
                 profile = src.profile.copy()
                 
                 # Update profile for float32 output
@@ -58,13 +98,8 @@ class TemperatureProcessor:
                 # Let's assume Level 2 ST product for simplicity as requested in prompt prompt: "apply scaling: temp_kelvin = DN * 0.00341802 + 149.0"
                 
                 # Handle NoData (usually 0)
-                mask = dn > 0
-                
-                temp_kelvin = np.zeros_like(dn)
-                temp_kelvin[mask] = dn[mask] * 0.00341802 + 149.0
-                
                 # 2. Convert to Celsius
-                temp_celsius = temp_kelvin - 273.15
+                # Steps 1, 2 and 4 (masking) plus stats run fused in _lst() below
                 
                 # 3. Apply emissivity correction (Simplified uniform emissivity)
                 # Real implementation should use NDVI based emissivity
@@ -102,16 +137,18 @@ class TemperatureProcessor:
                 # Decision: Skip explicit modification of L2 product to avoid data corruption, but acknowledge step.
                 
                 # 4. Mask invalid values
-                valid_mask = (temp_celsius > -50) & (temp_celsius < 70) & mask
-                final_temp = np.full_like(temp_celsius, -9999)
-                final_temp[valid_mask] = temp_celsius[valid_mask]
+                t_min, t_max, t_sum, t_sumsq, t_count = _lst(final_temp, final_temp)
+                
+                if t_count == 0:
+                    raise ValueError("No valid temperature data")
                 
                 # 5. Stats
+                t_mean = t_sum / t_count
                 stats = {
-                    "min": float(np.min(final_temp[valid_mask])),
-                    "max": float(np.max(final_temp[valid_mask])),
-                    "mean": float(np.mean(final_temp[valid_mask])),
-                    "std": float(np.std(final_temp[valid_mask]))
+                    "min": float(t_min),
+                    "max": float(t_max),
+                    "mean": t_mean,
+                    "std": math.sqrt(max(t_sumsq / t_count - t_mean * t_mean, 0.0))
                 }
                 
                 # 6. Save
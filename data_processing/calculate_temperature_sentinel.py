@@ -1,8 +1,72 @@
+import math
 import rasterio
 import numpy as np
+from numba import njit, prange
 from pathlib import Path
 import json
 from scipy.ndimage import gaussian_filter
+from backend.utils.gis_utils import GDAL_ENV, INT16_NODATA
+
+# Output is int16 degrees C * 100; readers apply the band scale
+TEMP_SCALE = 0.01
+
+# Sentinel-2 L2A: values are 0-10000 (reflectance * 10000), clipped to 0-0.5
+REFLECTANCE_SCALE = 1.0 / 10000.0
+MAX_REFLECTANCE = 0.5
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _swir_range(swir):
+    """Min/max clipped reflectance and count over valid (DN > 0) pixels, read from raw DNs."""
+    mn = np.inf
+    mx = -np.inf
+    n = 0
+    for i in prange(swir.shape[0]):
+        for j in range(swir.shape[1]):
+            d = swir[i, j]
+            if d > 0:
+                x = min(d * REFLECTANCE_SCALE, MAX_REFLECTANCE)
+                mn = min(mn, x)
+                mx = max(mx, x)
+                n += 1
+    return mn, mx, n
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _swir_to_temperature(swir, out, swir_min, denom, temp_min, temp_range):
+    """
+    Raw DNs to estimated degrees C in one pass: scale, clip, normalise, rescale.
+    Every pixel is converted (invalid ones are masked after smoothing, as before).
+    """
+    k = temp_range / denom
+    for i in prange(swir.shape[0]):
+        for j in range(swir.shape[1]):
+            x = min(max(swir[i, j] * REFLECTANCE_SCALE, 0.0), MAX_REFLECTANCE)
+            out[i, j] = temp_min + (x - swir_min) * k
+
+@njit(fastmath=True, cache=True)
+def _stats(a):
+    """
+    Min, max, mean and population std of a NaN-free 1-D array in one pass.
+    """
+    mn = np.inf
+    mx = -np.inf
+    s = 0.0
+    s2 = 0.0
+    for x in a:
+        mn = min(mn, x)
+        mx = max(mx, x)
+        s += x
+        s2 += x * x
+    mean = s / a.size
+    return mn, mx, mean, math.sqrt(max(s2 / a.size - mean * mean, 0.0))
+
+def _median(values):
+    """Exact median via O(n) partition instead of a full sort."""
+    n = values.size
+    k = n // 2
+    if n % 2:
+        return float(np.partition(values, k)[k])
+    part = np.partition(values, [k - 1, k])
+    return (float(part[k - 1]) + float(part[k])) / 2
 
 class SentinelTemperatureProcessor:
     """Process Sentinel-2 SWIR bands to estimate surface temperature"""
@@ -26,56 +90,53 @@ class SentinelTemperatureProcessor:
         swir_file = swir_files[0]
         print(f'Processing: {swir_file.name}')
         
-        with rasterio.open(swir_file) as src:
-            # Read SWIR data
-            swir = src.read(1).astype(float)
+        with rasterio.Env(**GDAL_ENV), rasterio.open(swir_file) as src:
+            # Read SWIR data (raw uint16 DNs; scaling happens in the kernels)
+            swir = src.read(1)
             
             # Get spatial reference info
             transform = src.transform
             crs = src.crs
             height, width = swir.shape
             
-            # Sentinel-2 L2A reflectance conversion
-            swir_reflectance = swir / 10000.0
-            swir_reflectance = np.clip(swir_reflectance, 0, 0.5)
+            # Valid pixels, computed once and reused; temp_celsius stays NaN-free
+            valid_mask = swir > 0
             
             # Temperature estimation
             temp_min = 25.0  
             temp_range = 25.0  
             
-            valid_swir = swir_reflectance[swir_reflectance > 0]
-            if valid_swir.size > 0:
-                swir_min = valid_swir.min()
-                swir_max = valid_swir.max()
-            else:
-                swir_min = 0
-                swir_max = 0.5
+            # Sentinel-2 L2A reflectance range over valid pixels (first pass)
+            swir_min, swir_max, n_valid = _swir_range(swir)
+            if n_valid == 0:
+                swir_min = 0.0
+                swir_max = MAX_REFLECTANCE
             
             denom = swir_max - swir_min
             if denom == 0:
                 denom = 1.0
             
-            swir_normalized = (swir_reflectance - swir_min) / denom
-            temp_celsius = temp_min + (swir_normalized * temp_range)
+            # Reflectance conversion, normalisation and rescale (second pass, float32 out)
+            temp_celsius = np.empty(swir.shape, np.float32)
+            _swir_to_temperature(swir, temp_celsius, swir_min, denom, temp_min, temp_range)
             
-            # Apply smoothing
+            # Apply smoothing (separable: one 1-D pass per axis, float32 in and out)
             temp_celsius = gaussian_filter(temp_celsius, sigma=2)
-            
-            # Mask invalid values
-            temp_celsius = np.where(swir == 0, np.nan, temp_celsius)
         
-        # Statistics
-        valid_temps = temp_celsius[~np.isnan(temp_celsius)]
+        # Statistics (single pass for the moments, partition for the median)
+        valid_temps = temp_celsius[valid_mask]
         
         if valid_temps.size == 0:
             raise ValueError("No valid temperature data!")
         
+        t_min, t_max, t_mean, t_std = _stats(valid_temps)
+        
         stats = {
-            'min': float(valid_temps.min()),
-            'max': float(valid_temps.max()),
-            'mean': float(valid_temps.mean()),
-            'std': float(valid_temps.std()),
-            'median': float(np.median(valid_temps)),
+            'min': float(t_min),
+            'max': float(t_max),
+            'mean': float(t_mean),
+            'std': float(t_std),
+            'median': _median(valid_temps),
             'note': 'Estimated from SWIR Band 11 (Sentinel-2)'
         }
         
@@ -87,26 +148,36 @@ class SentinelTemperatureProcessor:
         
         # FIX: Create NEW GeoTIFF profile (don't copy JP2 profile)
         profile = {
-            'driver': 'GTiff',          # Force GeoTIFF
+            'driver': 'COG',            # Cloud-optimized GeoTIFF
             'height': height,
             'width': width,
             'count': 1,
-            'dtype': 'float32',         # This is OK for GTiff
+            'dtype': 'int16',           # Scaled by TEMP_SCALE
             'crs': crs,
             'transform': transform,
-            'nodata': -9999,
-            'compress': 'lzw',
-            'tiled': True,
-            'blockxsize': 256,
-            'blockysize': 256
+            'nodata': INT16_NODATA,
+            'compress': 'DEFLATE',
+            'predictor': 2,
+            'blocksize': 512,
+            'overview_resampling': 'average',
+            'num_threads': 'ALL_CPUS'
         }
         
+        # Scaled int16 output, nodata sentinel only on invalid pixels
+        scaled = np.full(temp_celsius.shape, INT16_NODATA, np.int16)
+        scaled[valid_mask] = np.round(valid_temps * (1 / TEMP_SCALE))
+        
+        # The returned array keeps the -9999 convention of the pipeline
+        temp_celsius[~valid_mask] = -9999
+        
         # Ensure output directory exists
         Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         
         # Save as GeoTIFF
-        with rasterio.open(output_path, 'w', **profile) as dst:
-            dst.write(temp_celsius.astype('float32'), 1)
+        with rasterio.Env(**GDAL_ENV), rasterio.open(output_path, 'w', **profile) as dst:
+            dst.scales = (TEMP_SCALE,)
+            dst.offsets = (0.0,)
+            dst.write(scaled, 1)
         
         # Save statistics
         stats_path = str(output_path).replace('.tif', '_stats.json')
@@ -1,12 +1,123 @@
 import logging
 from typing import List, Dict
 import numpy as np
-import rasterio
-from scipy.ndimage import label, measurements
+import pandas as pd
+from rasterio.transform import AffineTransformer
+from numba import get_num_threads, njit, prange, vectorize
+from scipy import ndimage
+from scipy.ndimage import label
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Masks with more hotspot pixels than this are labelled with label_cc()
+CCL_NUMBA_MIN_PIXELS = 1_000_000
+
+@njit(parallel=True, cache=True)
+def _valid_mean(temp, nodata):
+    """Sum and count of pixels that are neither NaN nor nodata, without building a mask."""
+    s = 0.0
+    n = 0
+    for i in prange(temp.shape[0]):
+        for j in range(temp.shape[1]):
+            t = temp[i, j]
+            # NaN fails the self-comparison
+            if t == t and t != nodata:
+                s += t
+                n += 1
+    return s, n
+
+@njit(parallel=True, cache=True)
+def _hotspot_mask(temp, nodata, cutoff, out):
+    """Write the valid & temp > cutoff mask into out and return its pixel count."""
+    n = 0
+    for i in prange(temp.shape[0]):
+        for j in range(temp.shape[1]):
+            t = temp[i, j]
+            hot = t == t and t != nodata and t > cutoff
+            out[i, j] = hot
+            if hot:
+                n += 1
+    return n
+
+@njit(inline='always')
+def _find(parent, i):
+    # Path halving
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+@njit(inline='always')
+def _union(parent, a, b):
+    # The smaller index wins, so every root is its component's first pixel in scan order
+    ra = _find(parent, a)
+    rb = _find(parent, b)
+    if ra < rb:
+        parent[rb] = ra
+    elif rb < ra:
+        parent[ra] = rb
+
+@njit(parallel=True, cache=True)
+def _label_cc(mask, n_strips):
+    """Kernel for label_cc(); the strip count comes in as an argument so the cache stays valid."""
+    height, width = mask.shape
+    parent = np.empty(height * width, np.int32)
+    
+    bounds = np.linspace(0, height, n_strips + 1).astype(np.int64)
+    
+    for s in prange(n_strips):
+        for i in range(bounds[s], bounds[s + 1]):
+            for j in range(width):
+                if not mask[i, j]:
+                    continue
+                p = i * width + j
+                parent[p] = p
+                if j > 0 and mask[i, j - 1]:
+                    _union(parent, p - 1, p)
+                if i > bounds[s] and mask[i - 1, j]:
+                    _union(parent, p - width, p)
+                    
+    # Join components across strip seams
+    for s in range(1, n_strips):
+        i = bounds[s]
+        for j in range(width):
+            if mask[i, j] and mask[i - 1, j]:
+                _union(parent, (i - 1) * width + j, i * width + j)
+                
+    labels = np.zeros((height, width), np.int32)
+    n = 0
+    for i in range(height):
+        for j in range(width):
+            if not mask[i, j]:
+                continue
+            r = _find(parent, i * width + j)
+            if r == i * width + j:
+                n += 1
+                labels[i, j] = n
+            else:
+                # Root comes earlier in the scan, so it is already labelled
+                labels[i, j] = labels[r // width, r % width]
+    return labels, n
+
+def label_cc(mask: np.ndarray):
+    """
+    Connected-component labelling (4-connectivity), equivalent to scipy.ndimage.label.
+    
+    Union-find over flat pixel indices: horizontal strips are merged in parallel
+    (each strip only touches its own entries), the strip seams are merged serially,
+    then one scan assigns consecutive labels in order of first appearance.
+    
+    Args:
+        mask: 2D boolean array.
+        
+    Returns:
+        Tuple[np.ndarray, int]: int32 label array (0 = background) and number of labels.
+    """
+    # get_num_threads() inside the kernel would make numba refuse to cache it
+    n_strips = max(1, min(mask.shape[0], get_num_threads()))
+    return _label_cc(mask, n_strips)
+
 def classify_severity(intensity: float) -> str:
     """Classify Heat Island severity based on intensity (temp diff from mean)."""
     if intensity < 1.0:
@@ -18,6 +129,21 @@ def classify_severity(intensity: float) -> str:
     else:
         return 'extreme'
 
+# Severity labels indexed by _severity_code()
+SEVERITY_LEVELS = np.array(['low', 'medium', 'high', 'extreme'])
+
+@vectorize(['int8(float64)', 'int8(float32)'], cache=True)
+def _severity_code(intensity):
+    """Compiled ufunc form of classify_severity(), returning an index into SEVERITY_LEVELS."""
+    if intensity < 1.0:
+        return 0
+    elif intensity < 3.0:
+        return 1
+    elif intensity < 5.0:
+        return 2
+    else:
+        return 3
+
 def detect_heat_islands(temp_raster: np.ndarray, threshold: float = 3.0, min_size: int = 10, nodata: float = -9999, transform=None) -> List[Dict]:
     """
     Detect urban heat islands and convert pixel coordinates to REAL Lat/Lon.
@@ -32,61 +158,70 @@ def detect_heat_islands(temp_raster: np.ndarray, threshold: float = 3.0, min_siz
     Returns:
         List[Dict]: Objects with 'lat' and 'lon' for Mapbox/DeckGL.
     """
-    # Filter valid data
-    valid_mask = (temp_raster != nodata) & (~np.isnan(temp_raster))
-    valid_data = temp_raster[valid_mask]
+    # Mean over valid data (not nodata, not NaN)
+    valid_sum, valid_count = _valid_mean(temp_raster, nodata)
     
-    if valid_data.size == 0:
+    if valid_count == 0:
         logger.warning("No valid temperature data for detection.")
         return []
         
-    mean_temp = np.mean(valid_data)
+    mean_temp = valid_sum / valid_count
     
     # Identify hotspots
-    hotspot_mask = (temp_raster > (mean_temp + threshold)) & valid_mask
+    hotspot_mask = np.empty(temp_raster.shape, np.bool_)
+    n_hot = _hotspot_mask(temp_raster, nodata, mean_temp + threshold, hotspot_mask)
     
-    # Label connected regions
-    labeled_array, num_features = label(hotspot_mask)
+    # Label connected regions (parallel kernel for dense masks)
+    if n_hot > CCL_NUMBA_MIN_PIXELS:
+        labeled_array, num_features = label_cc(hotspot_mask)
+    else:
+        labeled_array, num_features = label(hotspot_mask)
     
     heat_islands = []
-    slices = measurements.find_objects(labeled_array)
-    
-    for i, slice_obj in enumerate(slices):
-        if slice_obj is None: continue
-            
-        feature_mask = (labeled_array[slice_obj] == (i + 1))
-        pixel_count = np.sum(feature_mask)
-        
-        if pixel_count < min_size: continue
-            
-        region_temps = temp_raster[slice_obj][feature_mask]
-        avg_t = float(np.mean(region_temps))
-        intensity = avg_t - mean_temp
+    if num_features == 0:
+        logger.info("Detected 0 heat islands with coordinates.")
+        return heat_islands
         
-        # 1. Calculate Centroid in PIXELS
-        coords = measurements.center_of_mass(feature_mask)
-        pixel_row = coords[0] + slice_obj[0].start
-        pixel_col = coords[1] + slice_obj[1].start
-        
-        # 2. TRANSFORM PIXELS TO LAT/LON
-        # This is what makes the "Click to Locate" work!
-        if transform:
-            lon, lat = rasterio.transform.xy(transform, pixel_row, pixel_col)
-        else:
-            # Fallback if transform is missing (not ideal)
-            lon, lat = 0.0, 0.0
-        
-        heat_islands.append({
-            "id": f"hi_{i + 1}",
-            "lat": round(float(lat), 6),       # ✅ Real Latitude
-            "lon": round(float(lon), 6),       # ✅ Real Longitude
-            "avg_temp": round(avg_t, 1),
-            "max_temp": round(float(np.max(region_temps)), 1),
-            "intensity": round(intensity, 1),
-            "severity": classify_severity(intensity),
-            "size_pixels": int(pixel_count)
-        })
+    # Per-label pixel counts and temperature sums in one pass each
+    lab_flat = labeled_array.ravel()
+    counts = np.bincount(lab_flat, minlength=num_features + 1)
+    sums = np.bincount(lab_flat, weights=temp_raster.ravel(), minlength=num_features + 1)
+    
+    # Labels big enough to keep
+    keep = np.flatnonzero(counts[1:] >= min_size) + 1
+    if keep.size == 0:
+        logger.info("Detected 0 heat islands with coordinates.")
+        return heat_islands
         
-    heat_islands.sort(key=lambda x: x['intensity'], reverse=True)
+    avg_temps = sums[keep] / counts[keep]
+    intensities = avg_temps - mean_temp
+    max_temps = np.asarray(ndimage.maximum(temp_raster, labeled_array, index=keep))
+    
+    # 1. Calculate Centroids in PIXELS (all regions at once)
+    centroids = np.asarray(ndimage.center_of_mass(hotspot_mask, labeled_array, index=keep))
+    
+    # 2. TRANSFORM PIXELS TO LAT/LON
+    # This is what makes the "Click to Locate" work!
+    if transform:
+        # One transformer, all centroids in a single batched call
+        lons, lats = AffineTransformer(transform).xy(centroids[:, 0], centroids[:, 1])
+    else:
+        # Fallback if transform is missing (not ideal)
+        lons = lats = np.zeros(keep.size)
+    
+    # Build all records column-wise, rounding each column in one call
+    df = pd.DataFrame({
+        "id": np.char.add("hi_", keep.astype(str)),
+        "lat": np.round(np.asarray(lats, dtype=float), 6),      # ✅ Real Latitude
+        "lon": np.round(np.asarray(lons, dtype=float), 6),      # ✅ Real Longitude
+        "avg_temp": np.round(avg_temps, 1),
+        "max_temp": np.round(max_temps.astype(float), 1),
+        "intensity": np.round(intensities, 1),
+        "severity": SEVERITY_LEVELS[_severity_code(intensities)],
+        "size_pixels": counts[keep]
+    })
+    df.sort_values("intensity", ascending=False, kind="stable", inplace=True)
+    heat_islands = df.to_dict("records")
+    
     logger.info(f"Detected {len(heat_islands)} heat islands with coordinates.")
     return heat_islands
\ No newline at end of file
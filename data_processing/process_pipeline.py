@@ -1,10 +1,13 @@
 import logging
-import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 import sys
 import numpy as np
+import orjson
 import rasterio
+from numba import get_num_threads, njit, prange
 
 # FIX: Suppress PROJ/GDAL warnings and set correct library path
 os.environ['PROJ_LIB'] = os.environ.get('PROJ_LIB', 'C:\\Program Files\\PostgreSQL\\16\\share\\contrib\\postgis-3.4\\proj') 
@@ -12,11 +15,19 @@ os.environ['PROJ_LIB'] = os.environ.get('PROJ_LIB', 'C:\\Program Files\\PostgreS
 # Add backend to path (Root is d:\Skills\Urban heat island)
 sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 
+# pyproj reads PROJ_LIB on import, so it is imported after the override above
+from pyproj import Transformer
+from scipy import ndimage
+
 from backend.data_processing.calculate_temperature_sentinel import SentinelTemperatureProcessor
 from backend.data_processing.calculate_ndvi import SentinelNDVIProcessor
+from backend.data_processing.recommend_green_spaces import build_aligned_stack, recommend_green_spaces
+from backend.data_processing.detect_heat_islands import CCL_NUMBA_MIN_PIXELS, label_cc
+from backend.utils.gis_utils import export_npy
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging. force=True: the processing modules imported above call
+# basicConfig() themselves, which would otherwise make this call a no-op
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
 logger = logging.getLogger(__name__)
 
 # CONFIG
@@ -24,100 +35,264 @@ DATA_SOURCE = "sentinel"
 CITY = "Los Angeles"
 SENTINEL_SCENE = "S2A_MSIL2A_20240715_LA" 
 
+# Heat island severity: intensity (C above mean) bin edges and labels
+SEVERITY_BINS = [2.0, 4.0, 6.0]
+SEVERITY_LABELS = np.array(['low', 'medium', 'high', 'extreme'])
+
+# NDVI class edges: bare < 0.2 <= sparse < 0.5 <= moderate < 0.7 <= dense.
+# float32 like the raster: float32(0.7) is below the float64 0.7, so an NDVI of
+# exactly 0.7 would otherwise fall into the class beneath
+NDVI_CLASS_BINS = np.array([0.2, 0.5, 0.7], dtype=np.float32)
+
+# Temperatures at or below this (C) are treated as invalid
+MIN_VALID_TEMP = -100.0
+
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
 
+@njit(parallel=True, cache=True)
+def _sum_above(a, floor):
+    """Sum and count of pixels above floor in one walk; NaN fails the comparison."""
+    s = 0.0
+    n = 0
+    for i in prange(a.shape[0]):
+        for j in range(a.shape[1]):
+            v = a[i, j]
+            if v > floor:
+                s += v
+                n += 1
+    return s, n
+
+@njit(parallel=True, cache=True)
+def _threshold_mask(a, cutoff, out):
+    """Write a > cutoff into out and return the number of True pixels, in one pass."""
+    n = 0
+    for i in prange(a.shape[0]):
+        for j in range(a.shape[1]):
+            hot = a[i, j] > cutoff
+            out[i, j] = hot
+            if hot:
+                n += 1
+    return n
+
+@njit(parallel=True, cache=True)
+def _ndvi_class_stats(ndvi, b0, b1, b2):
+    """
+    NDVI sum and per-class counts over pixels in [-1, 1], in one pass.
+    Classes are [-1, b0), [b0, b1), [b1, b2), [b2, 1] like np.digitize; NaN fails every test.
+    """
+    s = 0.0
+    c0 = 0
+    c1 = 0
+    c2 = 0
+    c3 = 0
+    for i in prange(ndvi.shape[0]):
+        for j in range(ndvi.shape[1]):
+            v = ndvi[i, j]
+            if v >= -1 and v <= 1:
+                s += v
+                if v < b0:
+                    c0 += 1
+                elif v < b1:
+                    c1 += 1
+                elif v < b2:
+                    c2 += 1
+                else:
+                    c3 += 1
+    return s, c0, c1, c2, c3
+
+@njit(parallel=True, cache=True)
+def _label_stats(labeled, temp, n, n_strips):
+    """
+    Pixel count, temperature sum and max, and row/col index sums per label,
+    all from one pass over the label array (index 0 is background).
+    
+    Row strips accumulate into private partial arrays that are reduced at the
+    end. n_strips is chosen by the caller (see _stat_strips()); computing it
+    here with get_num_threads() would stop numba from caching the kernel.
+    """
+    height, width = labeled.shape
+    bounds = np.linspace(0, height, n_strips + 1).astype(np.int64)
+    
+    counts = np.zeros((n_strips, n + 1), np.int64)
+    sums = np.zeros((n_strips, n + 1))
+    maxes = np.full((n_strips, n + 1), -np.inf)
+    row_sums = np.zeros((n_strips, n + 1))
+    col_sums = np.zeros((n_strips, n + 1))
+    
+    for s in prange(n_strips):
+        for i in range(bounds[s], bounds[s + 1]):
+            for j in range(width):
+                lab = labeled[i, j]
+                if lab:
+                    t = temp[i, j]
+                    counts[s, lab] += 1
+                    sums[s, lab] += t
+                    if t > maxes[s, lab]:
+                        maxes[s, lab] = t
+                    row_sums[s, lab] += i
+                    col_sums[s, lab] += j
+                    
+    # Fold the strip partials into strip 0
+    for s in range(1, n_strips):
+        for lab in range(1, n + 1):
+            counts[0, lab] += counts[s, lab]
+            sums[0, lab] += sums[s, lab]
+            if maxes[s, lab] > maxes[0, lab]:
+                maxes[0, lab] = maxes[s, lab]
+            row_sums[0, lab] += row_sums[s, lab]
+            col_sums[0, lab] += col_sums[s, lab]
+    return counts[0], sums[0], maxes[0], row_sums[0], col_sums[0]
+
+# Bytes of _label_stats() partials per strip and label: five 8-byte accumulators
+_STAT_SLOT_BYTES = 5 * 8
+
+def _stat_strips(labeled: np.ndarray, n: int) -> int:
+    """
+    Strip count for _label_stats(): one per thread, capped so that all the
+    partial arrays together take no more bytes than the label array. A single
+    strip is always used, so with very many labels the partials can still
+    exceed it (40 bytes per label against 4 per pixel).
+    """
+    fit = labeled.nbytes // (_STAT_SLOT_BYTES * (n + 1))
+    return max(1, min(labeled.shape[0], get_num_threads(), fit))
+
+def _write_json(path: Path, data) -> None:
+    """Write pipeline output as indented JSON; numpy scalars/arrays are serialized natively."""
+    path.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+
+def _process_temperature(raw_data_dir: str, output_path: str) -> dict:
+    """STEP 1 worker: write the temperature raster and return its profile."""
+    _, profile = SentinelTemperatureProcessor(raw_data_dir).process_swir_to_temperature(output_path)
+    return profile
+
+def _process_ndvi(raw_data_dir: str, output_path: str) -> dict:
+    """STEP 2 worker: write the NDVI raster and return its profile."""
+    _, profile = SentinelNDVIProcessor(raw_data_dir).calculate_ndvi(output_path, return_array=False)
+    return profile
+
+@lru_cache(maxsize=150)
+def _get_transformer(src_crs: str):
+    """
+    Return a cached CRS -> WGS84 (lon/lat) transformer.
+    Construction is expensive, so one is kept per source CRS (room for every UTM zone).
+    """
+    return Transformer.from_crs(src_crs, "epsg:4326", always_xy=True)
+
 def detect_heat_islands_simple(temp_raster, transform, crs, threshold=3.0):
     """
     Detect heat islands using simple threshold method and calculate real-world centroids.
     """
     logger.info("Detecting heat islands...")
     
-    from scipy import ndimage
-    from pyproj import Transformer
+    # Every pass below is memory-bound: keep the raster at 4 bytes per pixel
+    temp_raster = temp_raster.astype(np.float32, copy=False)
     
-    # Calculate mean temperature
-    valid_mask = ~np.isnan(temp_raster) & (temp_raster > -100)
-    valid_temps = temp_raster[valid_mask]
+    # Calculate mean temperature (single pass, no validity mask)
+    valid_sum, valid_count = _sum_above(temp_raster, MIN_VALID_TEMP)
     
-    if valid_temps.size == 0:
+    if valid_count == 0:
         logger.warning("No valid temperature data for heat island detection.")
         return {'total_count': 0, 'heat_islands': []}
 
-    mean_temp = valid_temps.mean()
+    mean_temp = valid_sum / valid_count
     
-    # Identify hotspots
-    hot_mask = (temp_raster > (mean_temp + threshold)) & valid_mask
+    # Identify hotspots: the cutoff is above MIN_VALID_TEMP and NaN compares
+    # False, so the comparison alone already excludes invalid pixels
+    hot_mask = np.empty(temp_raster.shape, np.bool_)
+    n_hot = _threshold_mask(temp_raster, np.float32(mean_temp + threshold), hot_mask)
     
-    # Label connected regions
-    labeled, num_features = ndimage.label(hot_mask)
-    heat_islands = []
+    # Label connected regions (parallel strip kernel for dense masks)
+    if n_hot > CCL_NUMBA_MIN_PIXELS:
+        labeled, num_features = label_cc(hot_mask)
+    else:
+        labeled, num_features = ndimage.label(hot_mask)
     
     # Initialize Coordinate Transformer
     try:
         src_crs = crs.to_string() if crs else "epsg:32611" # Default to UTM Zone 11N for LA
-        transformer = Transformer.from_crs(src_crs, "epsg:4326", always_xy=True)
+        transformer = _get_transformer(src_crs)
     except Exception as e:
         logger.error(f"Transformer initialization failed: {e}")
         transformer = None
 
-    for label_id in range(1, num_features + 1):
-        region = labeled == label_id
-        region_temps = temp_raster[region]
-        region_size = region.sum()
-        
-        # Skip small regions (noise reduction)
-        if region_size < 10:
-            continue
-        
-        intensity = float(region_temps.mean() - mean_temp)
-        
-        # Classify severity
-        if intensity >= 6: severity = 'extreme'
-        elif intensity >= 4: severity = 'high'
-        elif intensity >= 2: severity = 'medium'
-        else: severity = 'low'
-            
-        # Calculate Centroid in pixel coordinates (y=row, x=col)
-        cy, cx = ndimage.center_of_mass(region)
-        
-        # 1. Pixel to Projected Coordinates (x, y)
-        proj_x, proj_y = transform * (cx, cy)
-        
-        # 2. Projected to Geographic (Lon/Lat)
-        if transformer:
-            lon, lat = transformer.transform(proj_x, proj_y)
-        else:
-            lon, lat = 0.0, 0.0
-        
-        heat_islands.append({
+    # Every per-region stat from one fused pass over the label array
+    counts, sums, maxes, row_sums, col_sums = _label_stats(
+        labeled, temp_raster, num_features, _stat_strips(labeled, num_features)
+    )
+    
+    # Skip small regions (noise reduction); per-region columns stay as arrays
+    label_ids = np.flatnonzero(counts[1:] >= 10) + 1
+    sizes = counts[label_ids]
+    means = sums[label_ids] / sizes
+    maxes = maxes[label_ids]
+    total_count = int(label_ids.size)
+    
+    # Classify severity for all regions at once
+    intensities = means - mean_temp
+    sev_idx = np.digitize(intensities, SEVERITY_BINS)
+    
+    # Top 50 by (rounded) intensity descending; ties keep label order.
+    # The 50th-largest key comes from an O(N) partition; only keys at or above
+    # it (ties included, so the cut is exact) go through the stable sort.
+    keys = -np.round(intensities, 1)
+    top = np.arange(keys.size)
+    if keys.size > 50:
+        cutoff = np.partition(keys, 49)[49]
+        top = np.flatnonzero(keys <= cutoff)
+    top = top[np.argsort(keys[top], kind='stable')][:50]
+    
+    # Centroids of the returned regions only, in pixel coordinates (y=row, x=col):
+    # 1. Pixel to Projected Coordinates (x, y) with the affine applied to whole arrays
+    # 2. Projected to Geographic (Lon/Lat) in a single transformer call
+    if top.size:
+        cys = row_sums[label_ids[top]] / sizes[top]
+        cxs = col_sums[label_ids[top]] / sizes[top]
+        proj_xs = transform.a * cxs + transform.b * cys + transform.c
+        proj_ys = transform.d * cxs + transform.e * cys + transform.f
+    if top.size and transformer:
+        lons, lats = transformer.transform(proj_xs, proj_ys)
+    else:
+        lons = lats = np.zeros(top.size)
+
+    # Dicts are materialized for the returned regions only; each column is
+    # rounded and converted to Python scalars in one batch call
+    heat_islands = [
+        {
             'id': f'hi_{label_id}',
-            'avg_temp': round(float(region_temps.mean()), 1),
-            'max_temp': round(float(region_temps.max()), 1),
-            'intensity': round(intensity, 1),
-            'size_pixels': int(region_size),
+            'avg_temp': region_mean,
+            'max_temp': region_max,
+            'intensity': intensity,
+            'size_pixels': region_size,
             'severity': severity,
-            'lat': round(float(lat), 6), # Standardized 6 decimals for GIS
-            'lon': round(float(lon), 6)
-        })
-    
-    # Sort by intensity descending
-    heat_islands.sort(key=lambda x: x['intensity'], reverse=True)
+            'lat': lat, # Standardized 6 decimals for GIS
+            'lon': lon
+        }
+        for label_id, region_size, region_mean, region_max, intensity, severity, lat, lon in zip(
+            label_ids[top].tolist(),
+            sizes[top].tolist(),
+            np.round(means[top], 1).tolist(),
+            np.round(maxes[top], 1).tolist(),
+            np.round(intensities[top], 1).tolist(),
+            SEVERITY_LABELS[sev_idx[top]].tolist(),
+            np.round(np.asarray(lats, dtype=np.float64), 6).tolist(),
+            np.round(np.asarray(lons, dtype=np.float64), 6).tolist()
+        )
+    ]
     
-    severity_dist = {'extreme': 0, 'high': 0, 'medium': 0, 'low': 0}
-    for island in heat_islands:
-        severity_dist[island['severity']] += 1
+    low, medium, high, extreme = np.bincount(sev_idx, minlength=4).tolist()
+    severity_dist = {'extreme': extreme, 'high': high, 'medium': medium, 'low': low}
     
     result = {
-        'total_count': len(heat_islands),
+        'total_count': total_count,
         'mean_temperature': round(float(mean_temp), 1),
         'threshold_used': threshold,
         'severity_distribution': severity_dist,
-        'heat_islands': heat_islands[:50]  # Return top 50 for performance
+        'heat_islands': heat_islands  # Top 50 for performance
     }
     
-    logger.info(f"  Detected {len(heat_islands)} heat islands with valid coordinates")
+    logger.info(f"  Detected {total_count} heat islands with valid coordinates")
     return result
 
 def analyze_vegetation_simple(ndvi_raster):
@@ -125,16 +300,16 @@ def analyze_vegetation_simple(ndvi_raster):
     Simple vegetation analysis based on NDVI classes
     """
     logger.info("Analyzing vegetation...")
-    valid_ndvi = ndvi_raster[~np.isnan(ndvi_raster) & (ndvi_raster >= -1) & (ndvi_raster <= 1)]
+    ndvi_raster = ndvi_raster.astype(np.float32, copy=False)
+    # Validity, class counts and the sum in one fused pass: no mask, no
+    # compacted copy, no digitize index array
+    ndvi_sum, bare, sparse, moderate, dense = _ndvi_class_stats(ndvi_raster, *NDVI_CLASS_BINS)
+    total = bare + sparse + moderate + dense
     
-    if valid_ndvi.size == 0:
+    if total == 0:
         return {'vegetation_health': 'Unknown', 'mean_ndvi': 0}
 
-    total = len(valid_ndvi)
-    bare = (valid_ndvi < 0.2).sum()
-    sparse = ((valid_ndvi >= 0.2) & (valid_ndvi < 0.5)).sum()
-    moderate = ((valid_ndvi >= 0.5) & (valid_ndvi < 0.7)).sum()
-    dense = (valid_ndvi >= 0.7).sum()
+    mean_ndvi = ndvi_sum / total
     
     result = {
         'total_pixels': int(total),
@@ -144,8 +319,8 @@ def analyze_vegetation_simple(ndvi_raster):
             'moderate_vegetation': {'count': int(moderate), 'percentage': round(float(moderate/total*100), 2)},
             'dense_vegetation': {'count': int(dense), 'percentage': round(float(dense/total*100), 2)}
         },
-        'mean_ndvi': round(float(valid_ndvi.mean()), 3),
-        'vegetation_health': 'Good' if valid_ndvi.mean() > 0.4 else 'Moderate' if valid_ndvi.mean() > 0.25 else 'Poor'
+        'mean_ndvi': round(mean_ndvi, 3),
+        'vegetation_health': 'Good' if mean_ndvi > 0.4 else 'Moderate' if mean_ndvi > 0.25 else 'Poor'
     }
     
     logger.info(f"  Vegetation Health: {result['vegetation_health']}")
@@ -164,17 +339,25 @@ def run_complete_pipeline(city_name: str, scene_id: str):
         return False
     
     try:
-        # STEP 1: TEMPERATURE
+        # STEP 1 + 2: TEMPERATURE and NDVI
+        # They read disjoint band files (B11 vs B04/B08) and write separate
+        # rasters, so they run side by side in two processes. Only the profiles
+        # come back: the full-size arrays are not pickled across, the parent
+        # reads them from the .npy copies it writes for the API anyway.
         logger.info("STEP 1: Temperature Processing")
-        temp_processor = SentinelTemperatureProcessor(str(raw_data_dir))
-        temp_out = str(processed_dir / "temperature_la.tif")
-        temp_raster, temp_profile = temp_processor.process_swir_to_temperature(temp_out)
-        
-        # STEP 2: NDVI
         logger.info("STEP 2: NDVI Calculation")
-        ndvi_processor = SentinelNDVIProcessor(str(raw_data_dir))
+        temp_out = str(processed_dir / "temperature_la.tif")
         ndvi_out = str(processed_dir / "ndvi_la.tif")
-        ndvi_raster, _ = ndvi_processor.calculate_ndvi(ndvi_out)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            f_temp = executor.submit(_process_temperature, str(raw_data_dir), temp_out)
+            f_ndvi = executor.submit(_process_ndvi, str(raw_data_dir), ndvi_out)
+            temp_profile = f_temp.result()
+            f_ndvi.result()
+        
+        # Raw band copies the API memory-maps for point queries
+        # (float32 physical units, NoData as NaN)
+        temp_raster = np.load(export_npy(temp_out))
+        ndvi_raster = np.load(export_npy(ndvi_out))
         
         # STEP 3: HEAT ISLANDS (Using captured transform/crs)
         logger.info("STEP 3: Heat Island Detection")
@@ -183,15 +366,20 @@ def run_complete_pipeline(city_name: str, scene_id: str):
         
         heat_islands = detect_heat_islands_simple(temp_raster, transform, crs)
         hi_out = processed_dir / "heat_islands.json"
-        with open(hi_out, 'w') as f:
-            json.dump(heat_islands, f, indent=2)
+        _write_json(hi_out, heat_islands)
             
         # STEP 4: VEGETATION
         logger.info("STEP 4: Vegetation Analysis")
         veg_analysis = analyze_vegetation_simple(ndvi_raster)
         veg_out = processed_dir / "vegetation_analysis.json"
-        with open(veg_out, 'w') as f:
-            json.dump(veg_analysis, f, indent=2)
+        _write_json(veg_out, veg_analysis)
+            
+        # STEP 5: GREEN SPACE RECOMMENDATIONS (served as-is by the API)
+        logger.info("STEP 5: Green Space Recommendations")
+        aligned_out = build_aligned_stack(temp_out, ndvi_out, str(processed_dir / "temp_ndvi_aligned.tif"))
+        recommendations = recommend_green_spaces(aligned_out)
+        rec_out = processed_dir / "green_space_recommendations.json"
+        _write_json(rec_out, recommendations)
         
         logger.info("✅ PIPELINE COMPLETED SUCCESSFULLY!")
         return True
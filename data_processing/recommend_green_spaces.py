@@ -0,0 +1,233 @@
+import logging
+import json
+from typing import Dict
+import numpy as np
+import rasterio
+from numba import njit, prange
+from rasterio.enums import Resampling
+from rasterio.warp import reproject
+from backend.utils.gis_utils import apply_scale_offset, read_band
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Candidate NDVI ceiling, float32 like the raster so an NDVI of exactly 0.3 is not "below" it
+MAX_CANDIDATE_NDVI = np.float32(0.3)
+
+@njit(inline='always')
+def _is_valid(t, n, t_nodata, n_nodata):
+    # NaN != NaN, so NaN pixels fail the self-comparison; a NaN nodata never matches
+    return t == t and n == n and t != t_nodata and n != n_nodata
+
+@njit(parallel=True, cache=True)
+def _valid_mean(temp, ndvi, t_nodata, n_nodata):
+    """Sum and count of temperatures where both rasters are valid, in one pass."""
+    total = 0.0
+    count = 0
+    for i in prange(temp.shape[0]):
+        for j in range(temp.shape[1]):
+            t = temp[i, j]
+            if _is_valid(t, ndvi[i, j], t_nodata, n_nodata):
+                total += t
+                count += 1
+    return total, count
+
+@njit(parallel=True, cache=True)
+def _collect_candidates(temp, ndvi, t_nodata, n_nodata, cutoff):
+    """
+    Gather flat indices, temperatures and NDVI of candidate pixels
+    (valid, temp > cutoff, NDVI < 0.3) in raster order.
+    Rows are counted in parallel, then filled in parallel at their offsets.
+    """
+    height, width = temp.shape
+    row_counts = np.zeros(height, np.int64)
+    for i in prange(height):
+        c = 0
+        for j in range(width):
+            t = temp[i, j]
+            n = ndvi[i, j]
+            if _is_valid(t, n, t_nodata, n_nodata) and t > cutoff and n < MAX_CANDIDATE_NDVI:
+                c += 1
+        row_counts[i] = c
+
+    offsets = np.zeros(height + 1, np.int64)
+    offsets[1:] = np.cumsum(row_counts)
+    total = offsets[height]
+    flat_idx = np.empty(total, np.int64)
+    cand_temps = np.empty(total, np.float32)
+    cand_ndvis = np.empty(total, np.float32)
+
+    for i in prange(height):
+        k = offsets[i]
+        for j in range(width):
+            t = temp[i, j]
+            n = ndvi[i, j]
+            if _is_valid(t, n, t_nodata, n_nodata) and t > cutoff and n < MAX_CANDIDATE_NDVI:
+                flat_idx[k] = i * width + j
+                cand_temps[k] = t
+                cand_ndvis[k] = n
+                k += 1
+    return flat_idx, cand_temps, cand_ndvis
+
+def build_aligned_stack(temp_path: str, ndvi_path: str, output_path: str) -> str:
+    """
+    Write temperature and NDVI as one 2-band float32 GeoTIFF on a common grid.
+
+    The grid is the temperature raster downsampled 50% for analysis; NDVI is
+    resampled onto it, so the rasters no longer need matching shapes.
+    Invalid pixels are NaN in both bands.
+
+    Args:
+        temp_path: Temperature GeoTIFF.
+        ndvi_path: NDVI GeoTIFF covering the same area.
+        output_path: Destination for the aligned stack.
+
+    Returns:
+        str: output_path
+    """
+    with rasterio.Env(GDAL_CACHEMAX=512):
+        with rasterio.open(temp_path) as src_temp, rasterio.open(ndvi_path) as src_ndvi:
+            # Downsample for faster analysis
+            out_shape = (int(src_temp.height/2), int(src_temp.width/2))
+            transform = src_temp.transform * src_temp.transform.scale(
+                (src_temp.width / out_shape[1]),
+                (src_temp.height / out_shape[0])
+            )
+
+            stack = np.empty((2,) + out_shape, np.float32)
+            # Inputs are stored as scaled int16: back to physical units, NoData as NaN
+            read_band(src_temp, out=stack[0])
+
+            reproject(
+                source=rasterio.band(src_ndvi, 1),
+                destination=stack[1],
+                src_nodata=src_ndvi.nodata,
+                dst_transform=transform,
+                dst_crs=src_temp.crs,
+                dst_nodata=np.nan,
+                resampling=Resampling.nearest
+            )
+            apply_scale_offset(stack[1], src_ndvi.scales[0], src_ndvi.offsets[0])
+
+            profile = {
+                'driver': 'GTiff',
+                'height': out_shape[0],
+                'width': out_shape[1],
+                'count': 2,
+                'dtype': 'float32',
+                'crs': src_temp.crs,
+                'transform': transform,
+                'nodata': np.nan,
+                'interleave': 'pixel',
+                'compress': 'lzw',
+                'tiled': True,
+                'blockxsize': 256,
+                'blockysize': 256
+            }
+
+        with rasterio.open(output_path, 'w', **profile) as dst:
+            dst.write(stack)
+
+    logger.info(f"Saved aligned temperature/NDVI stack to {output_path}")
+    return output_path
+
+def recommend_green_spaces(stack_path: str, top_n: int = 500) -> Dict:
+    """
+    Rank candidate park locations: High Heat + Low Vegetation.
+
+    Candidates are pixels hotter than the mean + 2C with NDVI < 0.3, scored as
+    (Temp_norm * 0.6) + ((1 - NDVI) * 0.4) on a 50% downsampled grid.
+
+    Args:
+        stack_path: Aligned temperature/NDVI stack from build_aligned_stack().
+        top_n: Number of ranked candidates to keep.
+
+    Returns:
+        Dict: {"recommendations": [...], "total_count": int, "analysis_resolution": str}
+    """
+    with rasterio.Env(GDAL_CACHEMAX=512), rasterio.open(stack_path) as src:
+        # Both bands in one read: one file open and one walk over the tiles
+        temp, ndvi = src.read(out=np.empty((2, src.height, src.width), np.float32))
+        transform = src.transform
+
+        # Invalid pixels are filtered inside the kernels; NaN stands in for "no nodata"
+        nodata = np.float32(src.nodata) if src.nodata is not None else np.float32(np.nan)
+
+    result = {
+        "recommendations": [],
+        "total_count": 0,
+        "analysis_resolution": "downsampled_50pct"
+    }
+
+    # Calculate Mean Temp for threshold
+    total, count = _valid_mean(temp, ndvi, nodata, nodata)
+    if count == 0:
+        logger.warning("No valid pixels for green space recommendations.")
+        return result
+    mean_temp = total / count
+
+    # Find Candidates: Temp > Mean + 2 AND NDVI < 0.3 (compact 1D arrays, raster order)
+    flat_idx, cand_temps, cand_ndvis = _collect_candidates(temp, ndvi, nodata, nodata, mean_temp + 2)
+
+    if cand_temps.size == 0:
+        return result
+
+    # Normalize for scoring 0-1
+    # Avoid division by zero
+    t_min, t_max = np.min(cand_temps), np.max(cand_temps)
+    t_norm = (cand_temps - t_min) / (t_max - t_min) if t_max > t_min else np.zeros_like(cand_temps)
+
+    scores = (t_norm * 0.6) + ((1 - cand_ndvis) * 0.4)
+
+    # Top N by score desc, ties in raster order like a stable sort. The N-th
+    # largest score comes from an O(N) partition; only scores at or above it
+    # (ties included, so the cut is exact) go through the stable sort.
+    k = min(top_n, scores.size)
+    top = np.arange(scores.size)
+    if 0 < k < scores.size:
+        cutoff = np.partition(scores, scores.size - k)[scores.size - k]
+        top = np.flatnonzero(scores >= cutoff)
+    top = top[np.argsort(-scores[top], kind='stable')][:k]
+
+    # Row/col only for the winners, then pixel-centre coordinates in one affine pass
+    top_rows, top_cols = np.unravel_index(flat_idx[top], temp.shape)
+    top_rows = top_rows + 0.5
+    top_cols = top_cols + 0.5
+    lons = transform.a * top_cols + transform.b * top_rows + transform.c
+    lats = transform.d * top_cols + transform.e * top_rows + transform.f
+
+    # Columns for the winners, converted to Python floats in one batch each
+    top_scores = scores[top]
+    top_temps = cand_temps[top].tolist()
+    top_ndvis = cand_ndvis[top].tolist()
+    priorities = np.where(top_scores > 0.8, "high", "medium").tolist()
+
+    result["recommendations"] = [
+        {
+            "lat": lat,
+            "lon": lon,
+            "score": score,
+            "temperature": t,
+            "ndvi": n,
+            "priority": priority,
+            "reason": f"High temp ({t:.1f}C) & Low veg ({n:.2f})"
+        }
+        for lat, lon, score, t, n, priority in zip(
+            lats.tolist(), lons.tolist(), (top_scores * 100).tolist(),
+            top_temps, top_ndvis, priorities
+        )
+    ]
+    result["total_count"] = int(scores.size)
+
+    logger.info(f"Ranked {scores.size} green space candidates, kept top {k}.")
+    return result
+
+if __name__ == "__main__":
+    stack = build_aligned_stack(
+        '../../data/processed/temperature_la.tif',
+        '../../data/processed/ndvi_la.tif',
+        '../../data/processed/temp_ndvi_aligned.tif'
+    )
+    recommendations = recommend_green_spaces(stack)
+    with open('../../data/processed/green_space_recommendations.json', 'w') as f:
+        json.dump(recommendations, f, indent=2)
@@ -0,0 +1,13 @@
+import multiprocessing
+import os
+
+# Production server settings (the Flask dev server in app.py is for local use only)
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# One process per core; threads overlap raster/file I/O within each worker
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Load the app (and its preloaded rasters) once in the master so workers share it copy-on-write
+preload_app = True
@@ -0,0 +1,10 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The API modules import as top-level packages (api, utils), as app.py does
+sys.path.insert(0, str(ROOT))
+# The processing modules import as backend.*, with the checkout's parent on the
+# path, as process_pipeline.py does
+sys.path.append(str(ROOT.parent))
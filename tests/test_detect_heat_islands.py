@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from backend.data_processing.detect_heat_islands import _label_cc, label_cc
+
+def assert_same_labelling(labels, num, expected, expected_num):
+    """Same foreground, same number of components and a one-to-one label mapping."""
+    assert num == expected_num
+    fg = expected > 0
+    np.testing.assert_array_equal(labels > 0, fg)
+    pairs = np.unique(np.stack([labels[fg], expected[fg]]), axis=1)
+    assert pairs.shape[1] == expected_num
+    assert np.unique(pairs[0]).size == np.unique(pairs[1]).size == expected_num
+
+@pytest.mark.parametrize('shape', [(1, 1), (1, 97), (97, 1), (2, 50), (37, 41), (128, 128)])
+@pytest.mark.parametrize('density', [0.2, 0.5, 0.7])
+def test_label_cc_matches_scipy_on_random_masks(shape, density):
+    rng = np.random.default_rng(hash((shape, density)) & 0xFFFF)
+    mask = rng.random(shape) < density
+    expected, expected_num = ndimage.label(mask)
+
+    labels, num = label_cc(mask)
+    assert_same_labelling(labels, num, expected, expected_num)
+
+    # Every strip split, down to one row per strip, so components cross strip seams
+    for n_strips in sorted({1, 2, 3, 7, shape[0]}):
+        if n_strips <= shape[0]:
+            labels, num = _label_cc(mask, n_strips)
+            assert_same_labelling(labels, num, expected, expected_num)
+
+def test_label_cc_joins_components_across_strips():
+    # Two columns joined only by the bottom row: every strip sees two pieces
+    mask = np.zeros((40, 9), dtype=bool)
+    mask[:, 1] = True
+    mask[:, 7] = True
+    mask[-1, 1:8] = True
+    # Diagonal neighbours are separate under 4-connectivity
+    mask[0, 3] = mask[1, 4] = True
+
+    expected, expected_num = ndimage.label(mask)
+    assert expected_num == 3
+    for n_strips in (1, 4, 40):
+        labels, num = _label_cc(mask, n_strips)
+        assert_same_labelling(labels, num, expected, expected_num)
+
+def test_label_cc_empty_mask():
+    labels, num = label_cc(np.zeros((5, 6), dtype=bool))
+    assert num == 0
+    assert not labels.any()
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from backend.data_processing.process_pipeline import _label_stats, _stat_strips
+
+@pytest.mark.parametrize('shape', [(1, 120), (33, 1), (64, 48)])
+@pytest.mark.parametrize('n_strips', [1, 2, 5, None])
+def test_label_stats_match_ndimage(shape, n_strips):
+    rng = np.random.default_rng(sum(shape))
+    temp = rng.uniform(20, 45, shape).astype(np.float32)
+    mask = rng.random(shape) < 0.55
+    labeled, n = ndimage.label(mask)
+    if n_strips is None:
+        n_strips = _stat_strips(labeled, n)
+    n_strips = min(n_strips, shape[0])
+
+    counts, sums, maxes, row_sums, col_sums = _label_stats(labeled, temp, n, n_strips)
+    idx = np.arange(1, n + 1)
+
+    np.testing.assert_array_equal(counts[1:], ndimage.sum_labels(mask, labeled, idx))
+    np.testing.assert_allclose(sums[1:] / counts[1:], ndimage.mean(temp, labeled, idx), rtol=1e-6)
+    np.testing.assert_array_equal(maxes[1:], ndimage.maximum(temp, labeled, idx))
+
+    centroids = np.asarray(ndimage.center_of_mass(mask, labeled, idx)).reshape(-1, 2)
+    np.testing.assert_allclose(row_sums[1:] / counts[1:], centroids[:, 0])
+    np.testing.assert_allclose(col_sums[1:] / counts[1:], centroids[:, 1])
+
+def test_stat_strips_partials_fit_in_label_array():
+    labeled = np.zeros((1000, 1000), np.int32)
+    for n in (0, 10, 1_000, 99_999):
+        n_strips = _stat_strips(labeled, n)
+        assert n_strips >= 1
+        if n_strips > 1:
+            assert n_strips * (n + 1) * 40 <= labeled.nbytes
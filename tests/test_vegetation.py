@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import rasterio
+from flask import Flask
+from rasterio.transform import from_origin
+
+from api import vegetation
+from api.vegetation import vegetation_bp
+
+# 1 x 5 strip of stored NDVI codes (scale 1e-4, as written by calculate_ndvi):
+# just under the first edge, then exactly on each of the three edges, then NoData
+CODES = [1999, 2000, 5000, 7000, -32768]
+EXPECTED = ['bare_soil_urban', 'sparse_vegetation', 'moderate_vegetation', 'dense_vegetation', None]
+
+WEST, NORTH, RES = -118.5, 34.1, 0.01
+
+def _pixel_centre(col):
+    return {'lat': NORTH - RES / 2, 'lon': WEST + RES * col + RES / 2}
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = tmp_path / 'ndvi_la.tif'
+    profile = {
+        'driver': 'GTiff', 'height': 1, 'width': len(CODES), 'count': 1,
+        'dtype': 'int16', 'nodata': -32768, 'crs': 'EPSG:4326',
+        'transform': from_origin(WEST, NORTH, RES, RES)
+    }
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(np.array([CODES], dtype=np.int16), 1)
+        dst.scales = (0.0001,)
+        dst.offsets = (0.0,)
+    monkeypatch.setattr(vegetation, 'NDVI_RASTER_PATH', path)
+
+    app = Flask(__name__)
+    app.register_blueprint(vegetation_bp, url_prefix='/api')
+    return app.test_client()
+
+@pytest.mark.parametrize('col', range(len(CODES) - 1))
+def test_point_class_at_thresholds(client, col):
+    resp = client.post('/api/vegetation/point', json=_pixel_centre(col))
+    assert resp.status_code == 200
+    body = resp.get_json()
+    assert body['ndvi'] == round(CODES[col] / 10000, 3)
+    assert body['vegetation_level'] == EXPECTED[col]
+
+def test_points_match_point_endpoint(client):
+    points = [_pixel_centre(col) for col in range(len(CODES))]
+    resp = client.post('/api/vegetation/points', json=points)
+    assert resp.status_code == 200
+    levels = [r['vegetation_level'] for r in resp.get_json()]
+    assert levels == EXPECTED
+
+    for col, level in enumerate(levels[:-1]):
+        single = client.post('/api/vegetation/point', json=points[col]).get_json()
+        assert single['vegetation_level'] == level
@@ -1,6 +1,67 @@
+import logging
 import math
-from typing import Tuple, Optional
+import numbers
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, NamedTuple, Tuple, Optional
+import numpy as np
+import orjson
 import rasterio
+from rasterio.coords import BoundingBox
+from rasterio.enums import Resampling
+
+logger = logging.getLogger(__name__)
+
+# GDAL block cache size (MB) for the long-lived dataset handles below
+os.environ.setdefault('GDAL_CACHEMAX', '512')
+
+EARTH_RADIUS_KM = 6371.0
+
+# Heatmap output shapes
+HEATMAP_RESOLUTIONS = {
+    'low': (100, 100),
+    'medium': (200, 200),
+    'high': (500, 500)
+}
+
+# NoData code of the scaled int16 rasters written by the processing pipeline
+INT16_NODATA = -32768
+
+# GDAL settings for full-scene processing: multi-threaded block decode/encode,
+# a larger block cache, and no sidecar directory listing on open
+GDAL_ENV = {
+    'GDAL_NUM_THREADS': 'ALL_CPUS',
+    'GDAL_CACHEMAX': 1024,
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR'
+}
+
+# Per-thread open datasets: {path: (mtime, DatasetReader)}
+_datasets = threading.local()
+
+class RasterData(NamedTuple):
+    """Band 1 of a raster held in memory (physical units, NoData as NaN), with the metadata needed for point lookups."""
+    array: np.ndarray
+    transform: rasterio.Affine
+    inverse: rasterio.Affine
+    bounds: BoundingBox
+    
+    def contains(self, lat: float, lon: float) -> bool:
+        """Return True if the coordinate falls within the raster bounds."""
+        return (self.bounds.left <= lon <= self.bounds.right and
+                self.bounds.bottom <= lat <= self.bounds.top)
+    
+    def index(self, lat: float, lon: float) -> Tuple[int, int]:
+        """Return the (row, col) of the pixel containing an in-bounds coordinate."""
+        col, row = self.inverse * (lon, lat)
+        height, width = self.array.shape
+        # Points on the right/bottom edge map one past the last pixel
+        return min(int(row), height - 1), min(int(col), width - 1)
+
+# Loaded rasters: {path: (mtime, RasterData)}
+_rasters: Dict[str, Tuple[float, RasterData]] = {}
+_rasters_lock = threading.Lock()
 
 def validate_coordinates(lat: float, lon: float) -> bool:
     """
@@ -13,6 +74,10 @@ def validate_coordinates(lat: float, lon: float) -> bool:
     Returns:
         bool: True if coordinates are valid, False otherwise.
     """
+    # Numbers (the usual case) skip the conversion and its exception handling;
+    # NaN fails the range checks
+    if isinstance(lat, numbers.Real) and isinstance(lon, numbers.Real):
+        return -90 <= lat <= 90 and -180 <= lon <= 180
     try:
         lat = float(lat)
         lon = float(lon)
@@ -20,6 +85,213 @@ def validate_coordinates(lat: float, lon: float) -> bool:
     except (ValueError, TypeError):
         return False
 
+def validate_coordinates_batch(lats, lons) -> np.ndarray:
+    """
+    Vectorized validate_coordinates() for numeric arrays.
+    
+    Args:
+        lats (array-like): Latitude values (-90 to 90)
+        lons (array-like): Longitude values (-180 to 180)
+        
+    Returns:
+        np.ndarray: Boolean array, True where the coordinate pair is valid
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    # NaN compares False, so no separate isfinite pass is needed
+    return (lats >= -90) & (lats <= 90) & (lons >= -180) & (lons <= 180)
+
+def get_dataset(path) -> rasterio.io.DatasetReader:
+    """
+    Return a persistent read-only dataset for a raster, reopening it if the file changed.
+    
+    Handles are kept per thread because GDAL datasets must not be read
+    concurrently; callers must not close the returned dataset.
+    
+    Args:
+        path (str | Path): Path to the raster file
+        
+    Returns:
+        rasterio.io.DatasetReader: Open dataset
+    """
+    key = str(path)
+    mtime = os.stat(key).st_mtime
+    
+    handles = getattr(_datasets, 'handles', None)
+    if handles is None:
+        handles = _datasets.handles = {}
+        
+    cached = handles.get(key)
+    if cached is not None:
+        if cached[0] == mtime:
+            return cached[1]
+        cached[1].close()
+        
+    src = rasterio.open(key, sharing=False)
+    handles[key] = (mtime, src)
+    return src
+
+def apply_scale_offset(data: np.ndarray, scale: float, offset: float) -> np.ndarray:
+    """
+    Convert stored codes to physical units in place: data * scale + offset.
+    
+    Processed rasters use scale 1/N (1e-4, 0.01). Dividing the integer code by
+    N gives the correctly rounded float32, whereas multiplying by float32(1e-4)
+    can land one ulp under a class edge (2000 -> 0.19999999). Other scales are
+    applied as a float64 multiply.
+    
+    Args:
+        data (np.ndarray): float32 codes, modified in place (NaN stays NaN)
+        scale (float): Band scale
+        offset (float): Band offset
+        
+    Returns:
+        np.ndarray: data
+    """
+    if scale != 1.0:
+        inv = round(1 / scale) if scale > 0 else 0
+        if inv >= 1 and math.isclose(inv * scale, 1.0, rel_tol=1e-9):
+            data /= np.float32(inv)
+        else:
+            np.multiply(data, scale, out=data, dtype=np.float64)
+    if offset != 0.0:
+        data += np.float32(offset)
+    return data
+
+def read_band(src: rasterio.io.DatasetReader, **kwargs) -> np.ndarray:
+    """
+    Read band 1 as float32 in physical units.
+    
+    Applies the band's scale/offset (processed rasters are stored as scaled
+    int16) and turns NoData into NaN.
+    
+    Args:
+        src (rasterio.io.DatasetReader): Open dataset
+        **kwargs: Passed to src.read (e.g. out_shape, resampling)
+        
+    Returns:
+        np.ndarray: float32 array
+    """
+    data = src.read(1, out_dtype='float32', **kwargs)
+    if src.nodata is not None:
+        nodata = data == np.float32(src.nodata)
+    else:
+        nodata = None
+        
+    apply_scale_offset(data, src.scales[0], src.offsets[0])
+        
+    if nodata is not None:
+        data[nodata] = np.nan
+    return data
+
+def _npy_path(path: str) -> str:
+    """Path of the raw band-1 copy written by export_npy()."""
+    return os.path.splitext(path)[0] + '.npy'
+
+def export_npy(path) -> str:
+    """
+    Save band 1 of a raster as a .npy file next to it, for zero-copy loading.
+    The copy is float32 in physical units with NaN NoData (see read_band()).
+    
+    Args:
+        path (str | Path): Path to the raster file
+        
+    Returns:
+        str: Path of the written .npy file
+    """
+    key = str(path)
+    npy = _npy_path(key)
+    with rasterio.open(key) as src:
+        np.save(npy, read_band(src))
+    return npy
+
+def load_raster(path) -> RasterData:
+    """
+    Return band 1 of a raster as an in-memory array, reloading it if the file changed.
+    
+    If an up-to-date .npy copy from export_npy() exists it is memory-mapped
+    read-only, so the pages live in the OS page cache and are shared by all
+    worker processes instead of being copied into each one.
+    
+    Args:
+        path (str | Path): Path to the raster file
+        
+    Returns:
+        RasterData: The band array (float32, NaN NoData) with its transform and bounds
+    """
+    key = str(path)
+    mtime = os.stat(key).st_mtime
+    
+    cached = _rasters.get(key)
+    if cached is None or cached[0] != mtime:
+        with _rasters_lock:
+            cached = _rasters.get(key)
+            if cached is None or cached[0] != mtime:
+                npy = _npy_path(key)
+                use_npy = os.path.exists(npy) and os.stat(npy).st_mtime >= mtime
+                with rasterio.open(key) as src:
+                    array = np.load(npy, mmap_mode='r') if use_npy else read_band(src)
+                    raster = RasterData(array, src.transform, ~src.transform, src.bounds)
+                cached = _rasters[key] = (mtime, raster)
+                
+    return cached[1]
+
+def preload_raster(path) -> None:
+    """
+    Load a raster at import time if it exists (see load_raster()).
+    
+    With gunicorn --preload the band is then read once in the master and
+    shared copy-on-write by the forked workers. Failures are only logged;
+    requests will retry the load.
+    
+    Args:
+        path (str | Path): Path to the raster file
+    """
+    if not Path(path).exists():
+        return
+    try:
+        load_raster(path)
+    except Exception as e:
+        logger.warning(f"Could not preload raster {path}: {e}")
+
+@lru_cache(maxsize=16)
+def build_heatmap(path_str: str, mtime: float, resolution: str, unit: str) -> bytes:
+    """
+    Build the serialized heatmap payload of a raster for one resolution.
+    
+    The raster mtime is part of the cache key, so a rewritten file is rebuilt
+    and stale payloads age out of the LRU.
+    
+    Args:
+        path_str (str): Path to the raster file
+        mtime (float): Modification time of the file
+        resolution (str): Key of HEATMAP_RESOLUTIONS
+        unit (str): Unit label for the payload
+        
+    Returns:
+        bytes: JSON {"data", "bounds", "resolution", "unit"}; NoData is null
+    """
+    out_shape = HEATMAP_RESOLUTIONS[resolution]
+    
+    src = get_dataset(path_str)
+    # Read and resample (descaled to physical units, NoData as NaN)
+    data = read_band(src, out_shape=out_shape, resampling=Resampling.bilinear)
+    
+    bounds = {
+        "west": src.bounds.left,
+        "south": src.bounds.bottom,
+        "east": src.bounds.right,
+        "north": src.bounds.top
+    }
+    
+    # The float32 array is serialized directly in C (NaN as null), no per-pixel Python objects
+    return orjson.dumps({
+        "data": data,
+        "bounds": bounds,
+        "resolution": list(out_shape),
+        "unit": unit
+    }, option=orjson.OPT_SERIALIZE_NUMPY)
+
 def latlon_to_pixel(lat: float, lon: float, transform: rasterio.Affine) -> Tuple[int, int]:
     """
     Convert latitude/longitude to pixel coordinates (row, col) for a given transform.
@@ -52,6 +324,43 @@ def pixel_to_latlon(row: int, col: int, transform: rasterio.Affine) -> Tuple[flo
     lon, lat = transform * (col, row)
     return lat, lon
 
+def latlon_to_pixel_batch(lats, lons, transform: rasterio.Affine) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Array version of latlon_to_pixel(): one inverse affine pass over all points.
+    
+    Args:
+        lats (array-like): Latitudes
+        lons (array-like): Longitudes
+        transform (rasterio.Affine): Affine transform of the raster
+        
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (rows, cols) as integer arrays, truncated like int()
+    """
+    inv = ~transform
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    cols = inv.a * lons + inv.b * lats + inv.c
+    rows = inv.d * lons + inv.e * lats + inv.f
+    return rows.astype(np.intp), cols.astype(np.intp)
+
+def pixel_to_latlon_batch(rows, cols, transform: rasterio.Affine) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Array version of pixel_to_latlon(): one affine pass over all pixels.
+    
+    Args:
+        rows (array-like): Row indices (pass row + 0.5 for pixel centres)
+        cols (array-like): Column indices
+        transform (rasterio.Affine): Affine transform of the raster
+        
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (latitudes, longitudes)
+    """
+    rows = np.asarray(rows, dtype=np.float64)
+    cols = np.asarray(cols, dtype=np.float64)
+    lons = transform.a * cols + transform.b * rows + transform.c
+    lats = transform.d * cols + transform.e * rows + transform.f
+    return lats, lons
+
 def calculate_distance(coord1: Tuple[float, float], coord2: Tuple[float, float]) -> float:
     """
     Calculate Haversine distance between two points in kilometers.
@@ -66,7 +375,7 @@ def calculate_distance(coord1: Tuple[float, float], coord2: Tuple[float, float])
     lat1, lon1 = coord1
     lat2, lon2 = coord2
     
-    R = 6371  # Earth radius in km
+    R = EARTH_RADIUS_KM
     
     dlat = math.radians(lat2 - lat1)
     dlon = math.radians(lon2 - lon1)
@@ -75,6 +384,34 @@ def calculate_distance(coord1: Tuple[float, float], coord2: Tuple[float, float])
          math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
          math.sin(dlon / 2) * math.sin(dlon / 2))
     
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    c = 2 * math.asin(math.sqrt(min(a, 1.0)))
     
     return R * c
+
+def calculate_distances(lats1, lons1, lats2, lons2) -> np.ndarray:
+    """
+    Vectorized Haversine distance in kilometers.
+    
+    Same formula as calculate_distance(), evaluated over arrays in one pass;
+    inputs broadcast against each other, so one point can be compared with
+    many (or use [:, None] / [None, :] for a pairwise matrix).
+    
+    Args:
+        lats1, lons1 (array-like): First points in degrees
+        lats2, lons2 (array-like): Second points in degrees
+        
+    Returns:
+        np.ndarray: Distances in kilometers
+    """
+    lat1 = np.radians(lats1)
+    lat2 = np.radians(lats2)
+    dlat = lat2 - lat1
+    dlon = np.radians(np.subtract(lons2, lons1))
+    
+    a = (np.sin(dlat / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2)
+    
+    # Clip guards against a rounding a hair above 1 for antipodal points
+    c = 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    
+    return EARTH_RADIUS_KM * c
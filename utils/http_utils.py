@@ -0,0 +1,66 @@
+import zlib
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Iterable
+import orjson
+from flask import Response, make_response, request
+
+CACHE_CONTROL = 'public, max-age=60'
+
+def ojsonify(obj: Any) -> Response:
+    """
+    orjson-backed replacement for flask.jsonify.
+    
+    Args:
+        obj (Any): JSON-serializable data; numpy arrays/scalars and non-str dict keys are allowed
+        
+    Returns:
+        Response: application/json response
+    """
+    body = orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return Response(body, mimetype='application/json')
+
+def conditional_json(path_fn: Callable[[], Path], query_keys: Iterable[str] = ()) -> Callable:
+    """
+    Decorate a read-only view with ETag / If-None-Match handling.
+
+    The ETag is derived from the backing file's mtime and size, plus the
+    values of any query parameters that change the payload. A matching
+    If-None-Match short-circuits to 304 without calling the view.
+
+    Args:
+        path_fn (Callable[[], Path]): Returns the file the view's payload is built from
+        query_keys (Iterable[str]): Query parameters that select different payloads
+
+    Returns:
+        Callable: The view decorator
+    """
+    query_keys = tuple(query_keys)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                st = path_fn().stat()
+            except OSError:
+                # Missing file: let the view produce its own 404
+                return view(*args, **kwargs)
+
+            etag = f'{st.st_mtime_ns:x}-{st.st_size:x}'
+            if query_keys:
+                query = '&'.join(request.args.get(k, '') for k in query_keys)
+                etag += f'-{zlib.crc32(query.encode()):x}'
+
+            if request.if_none_match.contains(etag):
+                resp = make_response('', 304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = CACHE_CONTROL
+            return resp
+
+        return wrapper
+    return decorator